@@ -33,7 +33,10 @@ class Settings:
     AUTH_SERVICE_ANALYTICS_PRICE_SATS: int = int(os.getenv("AUTH_SERVICE_ANALYTICS_PRICE_SATS", "50"))
     SECRET_KEY: str = os.getenv("SECRET_KEY", "")
     APP_PORT: int = int(os.getenv("APP_PORT", "8000"))
+    DEBUG: bool = os.getenv("DEBUG", "").lower() in ("1", "true")  # reload templates on change
     BASE_URL: str = os.getenv("BASE_URL", "https://satring.com")
+    # Rate limit counters; point at redis://... to share limits across workers
+    RATE_LIMIT_STORAGE_URI: str = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
 
     # x402 settings
     X402_FACILITATOR_URL: str = os.getenv("X402_FACILITATOR_URL", "https://facilitator.xpay.sh")
@@ -44,6 +44,8 @@ async def init_db():
             ("hit_count_total", "INTEGER DEFAULT 0"),
             ("hit_count_7d", "INTEGER DEFAULT 0"),
             ("hit_count_30d", "INTEGER DEFAULT 0"),
+            ("rating_sum", "INTEGER DEFAULT 0"),
+            ("domain", "VARCHAR(500)"),
         ]
         for col_name, col_type in migrations:
             if col_name not in existing_cols:
@@ -51,6 +53,42 @@ async def init_db():
                     sqlalchemy.text(f"ALTER TABLE services ADD COLUMN IF NOT EXISTS {col_name} {col_type}")
                 )
 
+        if "rating_sum" not in existing_cols:
+            await conn.execute(sqlalchemy.text(
+                "UPDATE services SET rating_sum = COALESCE("
+                "(SELECT SUM(score) FROM ratings WHERE ratings.service_id = services.id), 0)"
+            ))
+
+        if "domain" not in existing_cols:
+            # Hostname parsing matches the model's url validator, so do it in Python
+            from app.models import url_hostname
+            rows = (await conn.execute(sqlalchemy.text("SELECT id, url FROM services"))).fetchall()
+            if rows:
+                await conn.execute(
+                    sqlalchemy.text("UPDATE services SET domain = :domain WHERE id = :id"),
+                    [{"id": row[0], "domain": url_hostname(row[1])} for row in rows],
+                )
+
+        result = await conn.execute(sqlalchemy.text(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = 'ratings'"
+        ))
+        if "payment_hash" not in {row[0] for row in result.fetchall()}:
+            await conn.execute(
+                sqlalchemy.text("ALTER TABLE ratings ADD COLUMN IF NOT EXISTS payment_hash VARCHAR(128)")
+            )
+
+        # Trigram search indexes (app.models) depend on this extension
+        if conn.dialect.name == "postgresql":
+            await conn.execute(sqlalchemy.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+        # create_all skips existing tables, so add indexes declared since then
+        def _create_missing_indexes(sync_conn):
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(sync_conn, checkfirst=True)
+
+        await conn.run_sync(_create_missing_indexes)
+
         # Rename status 'dead' -> 'down'
         await conn.execute(
             sqlalchemy.text("UPDATE services SET status = 'down' WHERE status = 'dead'")
@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import os
 from contextlib import asynccontextmanager
@@ -11,7 +12,7 @@ from fastapi.templating import Jinja2Templates
 from slowapi import Limiter
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
-from sqlalchemy import select
+from sqlalchemy import insert, literal, select
 from starlette.middleware.base import BaseHTTPMiddleware
 
 from app.config import settings
@@ -19,9 +20,16 @@ from app.database import init_db, async_session
 from app.models import Category
 from app.health import start_health_task, stop_health_task
 from app.usage import record_hit, record_details, record_agent, start_flush_task, stop_flush_task
+from app.utils import close_verify_client
+
 
 # SECURITY: Rate limiter to prevent abuse and DoS. Applied per-endpoint in route files.
-limiter = Limiter(key_func=get_remote_address)
+def _rate_limit_key(request: Request) -> str:
+    """Limiter key: salted hash of the client IP, so the counter store never holds raw IPs."""
+    return hashlib.sha256(f"{settings.SECRET_KEY}:{get_remote_address(request)}".encode()).hexdigest()[:16]
+
+
+limiter = Limiter(key_func=_rate_limit_key, storage_uri=settings.RATE_LIMIT_STORAGE_URI)
 
 
 class SecurityHeadersMiddleware(BaseHTTPMiddleware):
@@ -154,11 +162,13 @@ SEED_CATEGORIES = [
 
 async def seed_categories():
     async with async_session() as db:
-        result = await db.execute(select(Category).limit(1))
-        if result.scalars().first() is not None:
+        seeded = (await db.execute(select(literal(1)).select_from(Category).limit(1))).first()
+        if seeded is not None:
             return
-        for name, slug, description in SEED_CATEGORIES:
-            db.add(Category(name=name, slug=slug, description=description))
+        await db.execute(insert(Category), [
+            {"name": name, "slug": slug, "description": description}
+            for name, slug, description in SEED_CATEGORIES
+        ])
         await db.commit()
 
 
@@ -194,11 +204,14 @@ async def lifespan(app: FastAPI):
         logger.warning("AUTH_ROOT_KEY is 'test-mode' — payment gates are bypassed.")
     await init_db()
     await seed_categories()
+    for name in _PRELOAD_TEMPLATES:
+        templates.get_template(name)
     start_flush_task()
     start_health_task()
     yield
     await stop_health_task()
     await stop_flush_task()
+    await close_verify_client()
 
 
 app = FastAPI(title="satring", description="Curated paid API directory for AI agents. L402, x402, and MPP services with health monitoring, human/agent ratings, and MCP integration.", lifespan=lifespan, docs_url=None)
@@ -349,7 +362,24 @@ document.body.style.opacity = "1";
 
 from pathlib import Path
 
-templates = Jinja2Templates(directory=Path(__file__).parent / "templates")
+import jinja2  # noqa: E402
+
+templates = Jinja2Templates(env=jinja2.Environment(
+    loader=jinja2.FileSystemLoader(Path(__file__).parent / "templates"),
+    autoescape=jinja2.select_autoescape(),
+    # Templates only change on deploy; skip the per-render mtime check outside dev
+    auto_reload=settings.DEBUG,
+    bytecode_cache=jinja2.FileSystemBytecodeCache(),
+))
+
+# Compiled at startup so the first visitors don't pay for it
+_PRELOAD_TEMPLATES = (
+    "services/list.html",
+    "services/_card_grid.html",
+    "services/detail.html",
+    "services/_payment_widget.html",
+    "services/_review_bubble.html",
+)
 
 from app.routes.web import router as web_router   # noqa: E402
 from app.routes.api import router as api_router    # noqa: E402
@@ -1,13 +1,31 @@
 from datetime import datetime, timezone
+from urllib.parse import urlparse
 
+import sqlalchemy.dialects.postgresql  # noqa: F401  registers the typed to_tsvector() construct
 from sqlalchemy import (
-    Boolean, Column, Integer, String, Text, Float, DateTime, ForeignKey, Index, Table
+    DDL, Boolean, Column, Integer, String, Text, Float, DateTime, ForeignKey, Index, Table, event, func,
+    literal_column,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 
 from app.database import Base
 
 
+def search_document(name, description):
+    """Postgres full-text document for a service (name + description).
+
+    Only literal SQL constants, no bind parameters, so the search filter and
+    the GIN index on Service compile to the same expression and the planner
+    can answer @@ from the index.
+    """
+    return func.to_tsvector(
+        literal_column("'english'"),
+        func.coalesce(name, literal_column("''"))
+        .op("||")(literal_column("' '"))
+        .op("||")(func.coalesce(description, literal_column("''"))),
+    )
+
+
 service_categories = Table(
     "service_categories",
     Base.metadata,
@@ -27,6 +45,14 @@ class Category(Base):
     services = relationship("Service", secondary=service_categories, back_populates="categories")
 
 
+def url_hostname(url: str | None) -> str | None:
+    """Lowercased hostname of a URL (as utils.extract_domain), None if absent."""
+    try:
+        return urlparse(url).hostname or None if url else None
+    except ValueError:
+        return None
+
+
 class Service(Base):
     __tablename__ = "services"
 
@@ -34,6 +60,9 @@ class Service(Base):
     name = Column(String(200), nullable=False)
     slug = Column(String(200), nullable=False, unique=True, index=True)
     url = Column(String(500), nullable=False)
+    # url's hostname, kept in sync on assignment; as wide as url, since submitted
+    # hosts are only length-checked as part of the whole URL
+    domain = Column(String(500), nullable=True, index=True)
     description = Column(Text, default="")
     pricing_sats = Column(Integer, default=0)
     pricing_model = Column(String(50), default="per-request")
@@ -54,6 +83,7 @@ class Service(Base):
     mpp_currency = Column(String(50), nullable=True)       # "usd" or token address
     avg_rating = Column(Float, default=0.0)
     rating_count = Column(Integer, default=0)
+    rating_sum = Column(Integer, default=0)  # sum of scores, for O(1) avg updates
     status = Column(String(20), default="unverified")  # unverified | confirmed | live | down | purged
     last_probed_at = Column(DateTime(timezone=True), nullable=True)
     dead_since = Column(DateTime(timezone=True), nullable=True)
@@ -69,6 +99,43 @@ class Service(Base):
     categories = relationship("Category", secondary=service_categories, back_populates="services")
     ratings = relationship("Rating", back_populates="service", cascade="all, delete-orphan")
 
+    @validates("url")
+    def _sync_domain(self, key, url):
+        self.domain = url_hostname(url)
+        return url
+
+    # Directory/search sort orders (see SORT_COLUMNS in routes/web.py), restricted
+    # to listed rows so ORDER BY ... LIMIT and keyset cursors walk an index
+    # instead of sorting the table
+    __table_args__ = (
+        Index("ix_services_listed_popular", hit_count_30d.desc(), id.desc(),
+              postgresql_where=status != "purged"),
+        Index("ix_services_listed_newest", created_at.desc(), id.desc(),
+              postgresql_where=status != "purged"),
+        Index("ix_services_listed_top_rated", avg_rating.desc(), id.desc(),
+              postgresql_where=status != "purged"),
+        Index("ix_services_listed_cheapest", pricing_sats.asc(), id.desc(),
+              postgresql_where=status != "purged"),
+        Index("ix_services_listed_most_reviewed", rating_count.desc(), id.desc(),
+              postgresql_where=status != "purged"),
+        Index("ix_services_status", status),
+        # Full-text search (Postgres only; other dialects fall back to ILIKE)
+        Index("ix_services_search_fts", search_document(name, description),
+              postgresql_using="gin").ddl_if(dialect="postgresql"),
+        # Trigram indexes so search's ILIKE '%q%' substring branch is an index scan
+        Index("ix_services_name_trgm", name, postgresql_using="gin",
+              postgresql_ops={"name": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+        Index("ix_services_description_trgm", description, postgresql_using="gin",
+              postgresql_ops={"description": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
+
+# gin_trgm_ops needs pg_trgm before the services table's indexes are created
+event.listen(
+    Service.__table__, "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
 
 class ProbeHistory(Base):
     __tablename__ = "probe_history"
@@ -136,8 +203,16 @@ class Rating(Base):
     score = Column(Integer, nullable=False)
     comment = Column(Text, default="")
     reviewer_name = Column(String(200), default="Anonymous")
+    payment_hash = Column(String(128), nullable=True)  # Lightning invoice that paid for this review
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
 
     service = relationship("Service", back_populates="ratings")
 
+    __table_args__ = (
+        # Latest reviews for a service (detail page)
+        Index("ix_ratings_service_created", "service_id", "created_at"),
+        # One review per paid invoice; NULL (free/test-mode reviews) never conflicts
+        Index("ix_ratings_service_payment", "service_id", "payment_hash", unique=True),
+    )
+
 
@@ -1,15 +1,18 @@
+import functools
 import json
 import logging
 import math
 import secrets
 from datetime import datetime, timedelta, timezone
+from types import NoneType
+from typing import get_args
 from urllib.parse import urlparse
 
 logger = logging.getLogger("satring.api")
 
-import httpx
 from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query, Request
-from pydantic import BaseModel, Field, HttpUrl, field_validator, model_validator
+from fastapi.responses import Response
+from pydantic import BaseModel, Field, HttpUrl, TypeAdapter, field_validator, model_validator
 from sqlalchemy import case, or_, select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
@@ -27,7 +30,7 @@ from app.database import get_db
 from app.payment import require_payment
 from app.main import limiter
 from app.models import Service, Category, Rating, RouteUsage, UsageDetail, AgentUsage, ProbeHistory, service_categories
-from app.utils import generate_edit_token, hash_token, verify_edit_token, get_same_domain_services, domain_root, extract_domain, is_public_hostname, extract_email, send_verify_email, find_purged_service, find_existing_service, normalize_url, overwrite_purged_service, escape_like, normalize_protocol, protocol_filter, is_valid_protocol, VALID_PROTOCOLS, utc_now
+from app.utils import unique_slug, flush_with_unique_slug, generate_edit_token, hash_token, verify_edit_token, verify_edit_token_any, get_same_domain_services, domain_root, extract_domain, is_public_hostname, fetch_verify_challenge, extract_email, send_verify_email, get_domain_services_and_purged, find_existing_service, normalize_url, overwrite_purged_service, add_rating, category_filter, search_filter, normalize_protocol, protocol_filter, is_valid_protocol, VALID_PROTOCOLS, utc_now
 
 router = APIRouter(tags=["API"])
 
@@ -482,6 +485,64 @@ class ReputationResponse(BaseModel):
 
 # --- Helpers ---
 
+_SERVICE_LIST = TypeAdapter(list[ServiceOut])
+_RATING_LIST = TypeAdapter(list[RatingOut])
+
+
+def json_response(data, adapter: TypeAdapter | None = None, **kwargs) -> Response:
+    """Serialize a response model (or list, via its TypeAdapter) straight to JSON bytes.
+
+    Returning a Response skips FastAPI's jsonable_encoder pass and its
+    re-validation against response_model, which stays on the route for OpenAPI.
+    """
+    body = adapter.dump_json(data) if adapter else data.model_dump_json()
+    return Response(content=body, media_type="application/json", **kwargs)
+
+
+@functools.cache
+def _null_defaults(model: type[BaseModel], row_type: type) -> dict:
+    """Replacement for a NULL column in each of model's non-Optional fields.
+
+    The field's own default if it has one, else the column's scalar default
+    (e.g. description "" or protocol "L402"); None for fields with neither.
+    """
+    defaults = {}
+    for name, field in model.model_fields.items():
+        if field.annotation is NoneType or NoneType in get_args(field.annotation):
+            continue
+        if not field.is_required():
+            defaults[name] = field.get_default(call_default_factory=True)
+            continue
+        column = row_type.__table__.c.get(name)
+        has_default = column is not None and column.default is not None and column.default.is_scalar
+        defaults[name] = column.default.arg if has_default else None
+    return defaults
+
+
+def from_row(model: type[BaseModel], row, **values) -> BaseModel:
+    """Build an output model from an ORM row with model_construct, skipping validation.
+
+    Only for rows just read from the DB, whose columns already match the
+    schema; values overrides fields (e.g. nested models). NULLs in non-Optional
+    fields get the schema/column default so the JSON contract holds; a NULL
+    with no default falls back to model_validate, which rejects it as before.
+    """
+    for name in model.model_fields:
+        if name not in values:
+            values[name] = getattr(row, name)
+    for name, default in _null_defaults(model, type(row)).items():
+        if values[name] is None:
+            if default is None:
+                return model.model_validate(row)
+            values[name] = default
+    return model.model_construct(**values)
+
+
+def service_from_row(model: type[ServiceOut] | type[ServiceSummary], service: Service):
+    """ServiceOut/ServiceSummary for a row with categories loaded."""
+    return from_row(model, service, categories=[from_row(CategoryOut, c) for c in service.categories])
+
+
 async def paginated_services(
     db: AsyncSession, query, page: int, page_size: int,
     request: Request | None = None,
@@ -516,12 +577,12 @@ async def paginated_services(
 
     # Paid users get full ServiceOut; free tier gets thin ServiceSummary
     if paid or not payments_enabled():
-        return ServiceListOut(
-            services=[ServiceOut.model_validate(s) for s in services],
+        return ServiceListOut.model_construct(
+            services=[service_from_row(ServiceOut, s) for s in services],
             total=total, page=page, page_size=page_size,
         )
-    return ServiceListSummary(
-        services=[ServiceSummary.model_validate(s) for s in services],
+    return ServiceListSummary.model_construct(
+        services=[service_from_row(ServiceSummary, s) for s in services],
         total=total, page=page, page_size=page_size,
     )
 
@@ -1159,14 +1220,9 @@ async def bulk_export(request: Request, db: AsyncSession = Depends(get_db)):
         .where(Service.status != "purged")
         .order_by(Service.id)
     )
-    data = [ServiceOut.model_validate(s) for s in result.scalars().all()]
-    if settlement:
-        from fastapi.responses import JSONResponse
-        return JSONResponse(
-            content=[d.model_dump(mode="json") for d in data],
-            headers={"PAYMENT-RESPONSE": json.dumps(settlement)},
-        )
-    return data
+    data = [service_from_row(ServiceOut, s) for s in result.scalars().all()]
+    headers = {"PAYMENT-RESPONSE": json.dumps(settlement)} if settlement else None
+    return json_response(data, _SERVICE_LIST, headers=headers)
 
 
 @router.get("/categories", response_model=list[CategoryOut],
@@ -1178,6 +1234,16 @@ async def list_categories(request: Request, db: AsyncSession = Depends(get_db)):
     return [CategoryOut.model_validate(c) for c in result.scalars().all()]
 
 
+# list_services ORDER BY clauses, built once; newest first by default
+_LIST_SORTS = {
+    "top-rated": Service.avg_rating.desc(),
+    "cheapest": Service.pricing_sats.asc(),
+    "most-reviewed": Service.rating_count.desc(),
+    "popular": Service.hit_count_30d.desc(),
+}
+_LIST_DEFAULT_SORT = Service.created_at.desc()
+
+
 @router.get("/services", response_model=ServiceListSummary | ServiceListOut,
              responses={402: _402_RESPONSE},
              openapi_extra=_quota_extra(FREE_API_RESULTS_PER_DAY, settings.AUTH_PRICE_USD, "List services (summaries; pay for full details)"))
@@ -1193,21 +1259,15 @@ async def list_services(
     db: AsyncSession = Depends(get_db),
 ):
     protocol = normalize_protocol(protocol)
-    sort_map = {
-        "top-rated": Service.avg_rating.desc(),
-        "cheapest": Service.pricing_sats.asc(),
-        "most-reviewed": Service.rating_count.desc(),
-        "popular": Service.hit_count_30d.desc(),
-    }
-    order = sort_map.get(sort, Service.created_at.desc())
+    order = _LIST_SORTS.get(sort, _LIST_DEFAULT_SORT)
     query = select(Service).where(Service.status != "purged").order_by(order)
     if category:
-        query = query.join(service_categories).join(Category).where(Category.slug == category)
+        query = query.where(category_filter(category))
     if status and status in ("unverified", "confirmed", "live", "down"):
         query = query.where(Service.status == status)
     if protocol:
         query = query.where(protocol_filter(Service.protocol, protocol))
-    return await paginated_services(db, query, page, page_size, request=request)
+    return json_response(await paginated_services(db, query, page, page_size, request=request))
 
 
 @router.get("/services/{slug}", response_model=ServiceSummary | ServiceOut,
@@ -1231,8 +1291,8 @@ async def get_service(request: Request, slug: str, db: AsyncSession = Depends(ge
             paid = True
     # Paid users get full ServiceOut; free tier gets thin ServiceSummary
     if paid or not payments_enabled():
-        return ServiceOut.model_validate(service)
-    return ServiceSummary.model_validate(service)
+        return json_response(service_from_row(ServiceOut, service))
+    return json_response(service_from_row(ServiceSummary, service))
 
 
 @router.post("/services", response_model=ServiceCreateOut, status_code=201,
@@ -1274,23 +1334,18 @@ async def create_service(request: Request, body: ServiceCreate = None, backgroun
         db=db,
     )
 
-    from app.utils import unique_slug
-    slug = await unique_slug(db, body.name)
-
-    # Fetch same-domain services (used for token reuse + auto-verify)
-    domain_services = await get_same_domain_services(db, url_str)
-
-    # Check if existing token matches a same-domain service
-    token_reused = False
-    if body.existing_edit_token:
-        for ds in domain_services:
-            if ds.edit_token_hash and verify_edit_token(body.existing_edit_token, ds.edit_token_hash):
-                token_reused = True
-                break
+    # Same-domain services (token reuse + auto-verify) and any purged row with
+    # this URL (overwritten instead of creating a new one), in one query
+    domain_services, purged = await get_domain_services_and_purged(db, url_str)
 
+    # Reuse the existing token if it matches a same-domain service; the token
+    # is hashed once and compared against every row's hash
+    token_reused = bool(body.existing_edit_token) and verify_edit_token_any(
+        body.existing_edit_token, [ds.edit_token_hash for ds in domain_services]
+    )
     if token_reused:
         edit_token = body.existing_edit_token
-        edit_token_hash = ds.edit_token_hash
+        edit_token_hash = hash_token(edit_token)
     else:
         edit_token = generate_edit_token()
         edit_token_hash = hash_token(edit_token)
@@ -1304,12 +1359,10 @@ async def create_service(request: Request, body: ServiceCreate = None, backgroun
             inherited_challenge = ds.domain_challenge
             break
 
-    # Check for purged service with the same URL — overwrite instead of creating new
-    purged = await find_purged_service(db, url_str)
     if purged:
         await overwrite_purged_service(
             db, purged,
-            name=body.name, slug=slug, description=body.description,
+            name=body.name, slug=await unique_slug(db, body.name), description=body.description,
             pricing_sats=body.pricing_sats, pricing_model=body.pricing_model,
             protocol=body.protocol, owner_name=body.owner_name,
             owner_contact=body.owner_contact, logo_url=body.logo_url,
@@ -1325,7 +1378,7 @@ async def create_service(request: Request, body: ServiceCreate = None, backgroun
         service = purged
     else:
         service = Service(
-            name=body.name, slug=slug, url=url_str, description=body.description,
+            name=body.name, url=url_str, description=body.description,
             pricing_sats=body.pricing_sats, pricing_model=body.pricing_model,
             protocol=body.protocol, owner_name=body.owner_name,
             owner_contact=body.owner_contact, logo_url=body.logo_url,
@@ -1337,12 +1390,12 @@ async def create_service(request: Request, body: ServiceCreate = None, backgroun
             domain_verified=auto_verified,
             domain_challenge=inherited_challenge,
         )
+        cats = []
         if body.category_ids:
             cats = (await db.execute(
                 select(Category).where(Category.id.in_(body.category_ids))
             )).scalars().all()
-            service.categories = list(cats)
-        db.add(service)
+        await flush_with_unique_slug(db, service, body.name, cats)
 
     try:
         await db.commit()
@@ -1405,11 +1458,15 @@ async def update_service(
         service.pricing_sats = 0
         service.pricing_model = "per-request"
 
-    if body.category_ids is not None:
+    # Unchanged categories: skip the lookup and the service_categories rewrite
+    if body.category_ids is not None and set(body.category_ids) != {c.id for c in service.categories}:
         cats = (await db.execute(
             select(Category).where(Category.id.in_(body.category_ids))
         )).scalars().all()
         service.categories = list(cats)
+        # Category links live in service_categories, so bump the row's
+        # updated_at explicitly; the directory ETag keys off it
+        service.updated_at = utc_now()
 
     await db.commit()
     result = await db.execute(
@@ -1475,9 +1532,7 @@ async def api_recover_verify(request: Request, slug: str, db: AsyncSession = Dep
         raise HTTPException(status_code=400, detail="Cannot verify domain: hostname resolves to a private or unreachable address")
 
     try:
-        async with httpx.AsyncClient(timeout=10) as http:
-            resp = await http.get(verify_url)
-        fetched = resp.text.strip()
+        fetched = await fetch_verify_challenge(verify_url)
     except Exception:
         raise HTTPException(status_code=502, detail=f"Could not reach {verify_url}")
 
@@ -1516,14 +1571,12 @@ async def search_services(
     protocol = normalize_protocol(protocol)
     query = select(Service).where(Service.status != "purged").order_by(Service.created_at.desc())
     if q.strip():
-        # SECURITY: escape LIKE wildcards so user input is matched literally
-        pattern = f"%{escape_like(q.strip())}%"
-        query = query.where(Service.name.ilike(pattern, escape="\\") | Service.description.ilike(pattern, escape="\\"))
+        query = query.where(search_filter(q.strip(), db.bind.dialect.name))
     if status and status in ("unverified", "confirmed", "live", "down"):
         query = query.where(Service.status == status)
     if protocol:
         query = query.where(protocol_filter(Service.protocol, protocol))
-    return await paginated_services(db, query, page, page_size, request=request)
+    return json_response(await paginated_services(db, query, page, page_size, request=request))
 
 
 @router.get("/services/{slug}/ratings", response_model=list[RatingOut],
@@ -1542,7 +1595,7 @@ async def list_ratings(
         .order_by(Rating.created_at.desc())
         .offset(offset).limit(limit)
     )
-    return [RatingOut.model_validate(r) for r in result.scalars().all()]
+    return json_response([from_row(RatingOut, r) for r in result.scalars().all()], _RATING_LIST)
 
 
 @router.post("/services/{slug}/ratings", response_model=RatingOut, status_code=201,
@@ -1573,16 +1626,7 @@ async def create_rating(request: Request, slug: str, body: RatingCreate = None,
         comment=body.comment,
         reviewer_name=body.reviewer_name or "Anonymous",
     )
-    db.add(rating)
-    await db.flush()
-
-    avg_result = await db.execute(
-        select(func.avg(Rating.score), func.count(Rating.id))
-        .where(Rating.service_id == service.id)
-    )
-    avg_row = avg_result.one()
-    service.avg_rating = round(float(avg_row[0]), 1)
-    service.rating_count = avg_row[1]
+    await add_rating(db, service, rating)
     await db.commit()
     return RatingOut.model_validate(rating)
 
@@ -1600,7 +1644,7 @@ async def analytics(request: Request, db: AsyncSession = Depends(get_db)):
         memo="satring.com analytics access",
         db=db,
     )
-    return await build_analytics_data(db)
+    return json_response(await build_analytics_data(db))
 
 
 @router.get("/services/{slug}/reputation", response_model=ReputationResponse,
@@ -1614,7 +1658,7 @@ async def reputation(request: Request, slug: str, db: AsyncSession = Depends(get
         memo="satring.com reputation lookup",
         db=db,
     )
-    return await build_reputation_data(db, slug)
+    return json_response(await build_reputation_data(db, slug))
 
 
 @router.get("/services/{slug}/analytics", response_model=ServiceAnalyticsResponse,
@@ -1704,11 +1748,7 @@ async def _verify_owner_token(request: Request, services: list) -> None:
     token = request.headers.get("X-Edit-Token", "")
     if not token:
         raise HTTPException(403, "X-Edit-Token header required for owner analytics")
-    verified = any(
-        s.edit_token_hash and verify_edit_token(token, s.edit_token_hash)
-        for s in services
-    )
-    if not verified:
+    if not verify_edit_token_any(token, (s.edit_token_hash for s in services)):
         raise HTTPException(403, "Invalid X-Edit-Token for this domain")
 
 
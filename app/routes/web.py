@@ -1,16 +1,20 @@
+import base64
+import hashlib
+import json
 import logging
 import math
-from datetime import timedelta, timezone
-from urllib.parse import urlparse
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode, urlparse
 
 logger = logging.getLogger("satring.web")
 
-import httpx
 from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, Depends, Form, Query
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
-from sqlalchemy import select, func, case
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
+from sqlalchemy import select, func, case, and_, or_, tuple_, DateTime, Float
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import joinedload, raiseload, selectinload
 
 from app.config import (
     settings, payments_enabled, MAX_NAME, MAX_URL, MAX_DESCRIPTION, MAX_OWNER_NAME,
@@ -22,14 +26,215 @@ from app.config import (
 )
 from app.database import get_db
 from app.l402 import create_invoice, check_payment_status, check_and_consume_payment
-from app.main import templates, limiter
+from app.main import templates, limiter, SEED_CATEGORIES
 from app.models import Service, Category, Rating, service_categories
 from app.routes.api import build_reputation_data, build_analytics_data, build_service_analytics
-from app.utils import unique_slug, generate_edit_token, hash_token, verify_edit_token, get_same_domain_services, domain_root, extract_domain, is_public_hostname, extract_email, send_verify_email, find_purged_service, find_existing_service, normalize_url, overwrite_purged_service, escape_like, normalize_protocol, protocol_filter, is_valid_protocol, BASE_PROTOCOLS, utc_now
+from app.utils import unique_slug, flush_with_unique_slug, generate_edit_token, hash_token, verify_edit_token, verify_edit_token_any, get_same_domain_services, domain_root, extract_domain, is_public_hostname, fetch_verify_challenge, extract_email, send_verify_email, get_domain_services_and_purged, find_existing_service, normalize_url, overwrite_purged_service, add_rating, category_filter, search_filter, normalize_protocol, protocol_filter, is_valid_protocol, BASE_PROTOCOLS, utc_now, services_version
 
 router = APIRouter(include_in_schema=False)
 
 PAGE_SIZE = 20
+DETAIL_RATINGS_LIMIT = 20
+
+# Directory/search sort orders: (column, descending). Built once at import;
+# every order gets an id.desc() tiebreak, which also anchors keyset cursors.
+SORT_COLUMNS = {
+    "top-rated": (Service.avg_rating, True),
+    "cheapest": (Service.pricing_sats, False),
+    "most-reviewed": (Service.rating_count, True),
+    "popular": (Service.hit_count_30d, True),
+    "newest": (Service.created_at, True),
+}
+DEFAULT_SORT = "popular"
+
+# Web submit form field limits (name, max chars); the API enforces the same
+# constants through its pydantic models
+SUBMIT_LENGTH_LIMITS = (
+    ("name", MAX_NAME), ("url", MAX_URL), ("description", MAX_DESCRIPTION),
+    ("owner_name", MAX_OWNER_NAME), ("owner_contact", MAX_OWNER_CONTACT),
+    ("logo_url", MAX_LOGO_URL), ("x402_network", MAX_X402_NETWORK),
+    ("x402_asset", MAX_X402_ASSET), ("x402_pay_to", MAX_X402_PAY_TO),
+    ("pricing_usd", MAX_PRICING_USD),
+    ("mpp_method", MAX_MPP_METHOD), ("mpp_realm", MAX_MPP_REALM),
+    ("mpp_currency", MAX_MPP_CURRENCY),
+)
+ALLOWED_URL_SCHEMES = frozenset(("http", "https"))
+
+# Listing pages are public and identical for every visitor; keep the browser
+# copy short-lived and let clients revalidate against the ETag
+LISTING_CACHE_CONTROL = "public, max-age=5"
+
+
+# Filtered listing totals keyed by (services version, filters). A new version
+# makes old keys unreachable, so entries never go stale; the dict is simply
+# cleared when it outgrows its bound.
+_listing_counts: dict[tuple, int] = {}
+_LISTING_COUNTS_MAX = 1024
+
+# Categories are seeded at startup and only change on deploy; keep the sorted
+# list for CATEGORY_CACHE_TTL seconds
+CATEGORY_CACHE_TTL = 300
+_category_cache: tuple[list, float] = ([], 0.0)
+
+
+async def _get_categories(db: AsyncSession) -> list:
+    """All categories ordered by name, served from the in-process cache.
+
+    Plain rows (id, name, slug, description) rather than ORM objects, so the
+    cached list is never tied to, or shared with, any request's session.
+    """
+    global _category_cache
+    categories, fetched_at = _category_cache
+    if categories and time.monotonic() - fetched_at < CATEGORY_CACHE_TTL:
+        return categories
+    categories = list((await db.execute(
+        select(Category.id, Category.name, Category.slug, Category.description).order_by(Category.name)
+    )).all())
+    _category_cache = (categories, time.monotonic())
+    return categories
+
+
+# How long the table scan behind _listing_version is reused; matches the
+# listing max-age, so other workers' writes show up no later than a browser copy
+LISTING_VERSION_TTL = 5
+_listing_db_version: tuple[tuple, float] = ((), 0.0)
+
+
+async def _listing_version(db: AsyncSession) -> tuple:
+    """Version of the services table for caching listings.
+
+    This process's writes move services_version() at once, including the
+    usage flush that rewrites hit counts (the "popular" order). The table
+    terms catch other workers: edits, ratings, probes and purges move
+    max(updated_at), deletes the row count, hit-count flushes
+    sum(hit_count_30d). They are one scan, reused for LISTING_VERSION_TTL,
+    so 304s don't pay for it.
+    """
+    global _listing_db_version
+    table_version, fetched_at = _listing_db_version
+    if not table_version or time.monotonic() - fetched_at >= LISTING_VERSION_TTL:
+        table_version = tuple((await db.execute(
+            select(func.max(Service.updated_at), func.count(Service.id), func.sum(Service.hit_count_30d))
+        )).one())
+        _listing_db_version = (table_version, time.monotonic())
+    return (services_version(), *table_version)
+
+
+def _listing_etag(request: Request, version: tuple) -> str:
+    """ETag for directory/search: the query string plus the services version."""
+    key = f"{'|'.join(map(str, version))}|{request.url.path}?{request.url.query}"
+    return '"' + hashlib.blake2b(key.encode(), digest_size=8).hexdigest() + '"'
+
+
+def _not_modified(request: Request, etag: str, cache_control: str = LISTING_CACHE_CONTROL) -> Response | None:
+    """Return a 304 if the client already holds this ETag."""
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in {t.strip().removeprefix("W/") for t in if_none_match.split(",")}:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+
+async def _get_live_service(db: AsyncSession, slug: str, *options) -> Service | None:
+    """Load a non-purged service by slug, with optional loader options.
+
+    Returns None when missing; each route answers with its own 404 body
+    (full page, HTMX fragment or JSON).
+    """
+    result = await db.execute(
+        select(Service).options(*options)
+        .where(Service.slug == slug)
+        .where(Service.status != "purged")
+    )
+    # unique(): required when a joinedload collection is among the options
+    return result.unique().scalars().first()
+
+
+def _encode_cursor(column, service: Service) -> str | None:
+    """Opaque ?after= token for the row following `service` in `column` order."""
+    value = getattr(service, column.key)
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, service.id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _decode_cursor(column, cursor: str) -> tuple | None:
+    """Inverse of _encode_cursor; None for anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, service_id = json.loads(raw)
+        if isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif isinstance(column.type, Float):
+            value = float(value)
+        else:
+            value = int(value)
+        return value, int(service_id)
+    except (ValueError, TypeError):
+        return None
+
+
+async def _fetch_page(
+    db: AsyncSession, query, sort: str | None, page: int, after: str | None, count_key: tuple,
+) -> tuple[list[Service], int, int, str | None]:
+    """Run a filtered listing query for one page.
+
+    With a valid `after` cursor the page starts right after the cursor row
+    (keyset: an index range scan however deep the page is); otherwise it
+    falls back to OFFSET, which first-page visits and crawlers use.
+    The total behind page counts is only computed once per `count_key`
+    (services version + filters), not on every page view. Every write to
+    services moves the version, hit-count flushes included, so totals are
+    recounted at least once per USAGE_FLUSH_INTERVAL. That is intended: a
+    flush can't purge or add rows, but the version can't tell it apart from
+    writes that do, and one count per filter per flush is still cheap.
+    Returns (services, page, total_pages, next_cursor).
+    """
+    column, descending = SORT_COLUMNS.get(sort, SORT_COLUMNS[DEFAULT_SORT])
+
+    total = _listing_counts.get(count_key)
+    if total is None:
+        count_q = select(func.count()).select_from(query.subquery())
+        total = (await db.execute(count_q)).scalar() or 0
+        if len(_listing_counts) >= _LISTING_COUNTS_MAX:
+            _listing_counts.clear()
+        _listing_counts[count_key] = total
+    total_pages = max(1, math.ceil(total / PAGE_SIZE))
+    page = min(page, total_pages)
+
+    # id.desc() tiebreak keeps ordering deterministic when primary keys collide
+    # (e.g. seed imports share a created_at, ratings share a count).
+    query = query.order_by(column.desc() if descending else column.asc(), Service.id.desc())
+    keyset = _decode_cursor(column, after) if after else None
+    if keyset is not None:
+        value, service_id = keyset
+        if descending:
+            query = query.where(tuple_(column, Service.id) < tuple_(value, service_id))
+        else:
+            query = query.where(or_(column > value, and_(column == value, Service.id < service_id)))
+    else:
+        query = query.offset((page - 1) * PAGE_SIZE)
+
+    services = (await db.execute(query.limit(PAGE_SIZE))).scalars().all()
+    next_cursor = None
+    if page < total_pages and len(services) == PAGE_SIZE:
+        next_cursor = _encode_cursor(column, services[-1])
+    return services, page, total_pages, next_cursor
+
+
+def _listing_qs(q: str, category: str | None, status: str | None, verified: str | None,
+                sort: str | None, protocol: str | None = None) -> str:
+    """Query string preserving a listing's filters, for its pagination links."""
+    return urlencode({k: v for k, v in (
+        ("q", q),
+        ("category", category),
+        ("verified", "true" if verified == "true" else None),
+        ("status", status if verified != "true" else None),
+        ("protocol", protocol),
+        ("sort", sort),
+    ) if v})
 
 
 @router.get("/directory", response_class=HTMLResponse)
@@ -42,19 +247,29 @@ async def directory(
     verified: str | None = None,
     protocol: str | None = None,
     page: int = Query(1, ge=1),
+    after: str | None = None,
     db: AsyncSession = Depends(get_db),
 ):
     protocol = normalize_protocol(protocol)
+    q = q.strip()
+
+    version = await _listing_version(db)
+    etag = _listing_etag(request, version)
+    if (not_modified := _not_modified(request, etag)) is not None:
+        return not_modified
 
-    categories = (await db.execute(select(Category).order_by(Category.name))).scalars().all()
+    categories = await _get_categories(db)
 
-    query = select(Service).options(selectinload(Service.categories)).where(Service.status != "purged")
-    if q.strip():
-        # SECURITY: escape LIKE wildcards so user input is matched literally
-        pattern = f"%{escape_like(q.strip())}%"
-        query = query.where(Service.name.ilike(pattern, escape="\\") | Service.description.ilike(pattern, escape="\\"))
+    # raiseload: a card touching any other relationship errors instead of N+1
+    query = (
+        select(Service)
+        .options(selectinload(Service.categories), raiseload("*"))
+        .where(Service.status != "purged")
+    )
+    if q:
+        query = query.where(search_filter(q, db.bind.dialect.name))
     if category:
-        query = query.join(service_categories).join(Category).where(Category.slug == category)
+        query = query.where(category_filter(category))
     if status:
         query = query.where(Service.status == status)
     if verified == "true":
@@ -62,42 +277,13 @@ async def directory(
     if protocol:
         query = query.where(protocol_filter(Service.protocol, protocol))
 
-    sort_map = {
-        "top-rated": Service.avg_rating.desc(),
-        "cheapest": Service.pricing_sats.asc(),
-        "most-reviewed": Service.rating_count.desc(),
-        "popular": Service.hit_count_30d.desc(),
-        "newest": Service.created_at.desc(),
-    }
-    # id.desc() tiebreak keeps ordering deterministic when primary keys collide
-    # (e.g. seed imports share a created_at, ratings share a count).
-    query = query.order_by(sort_map.get(sort, Service.hit_count_30d.desc()), Service.id.desc())
-
-    # Count total for pagination
-    count_q = select(func.count()).select_from(query.subquery())
-    total = (await db.execute(count_q)).scalar() or 0
-    total_pages = max(1, math.ceil(total / PAGE_SIZE))
-    page = min(page, total_pages)
+    services, page, total_pages, next_cursor = await _fetch_page(
+        db, query, sort, page, after, (version, q, category, status, verified, protocol),
+    )
 
-    services = (await db.execute(query.offset((page - 1) * PAGE_SIZE).limit(PAGE_SIZE))).scalars().all()
+    qs_base = _listing_qs(q, category, status, verified, sort, protocol)
 
-    # Build qs_base for pagination links (preserving existing filters)
-    qs_parts = []
-    if q.strip():
-        qs_parts.append(f"q={q.strip()}")
-    if category:
-        qs_parts.append(f"category={category}")
-    if verified == "true":
-        qs_parts.append("verified=true")
-    elif status:
-        qs_parts.append(f"status={status}")
-    if protocol:
-        qs_parts.append(f"protocol={protocol.replace('+', '%2B')}")
-    if sort:
-        qs_parts.append(f"sort={sort}")
-    qs_base = "&".join(qs_parts)
-
-    return templates.TemplateResponse(request, "services/list.html", {
+    response = templates.TemplateResponse(request, "services/list.html", {
         "services": services,
         "categories": categories,
         "active_category": category,
@@ -105,12 +291,16 @@ async def directory(
         "active_sort": sort,
         "active_verified": verified,
         "active_protocol": protocol,
-        "active_q": q.strip(),
+        "active_q": q,
         "page": page,
         "total_pages": total_pages,
+        "next_cursor": next_cursor,
         "qs_base": qs_base,
         "analytics_price_sats": settings.AUTH_ANALYTICS_PRICE_SATS,
     })
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = LISTING_CACHE_CONTROL
+    return response
 
 
 @router.get("/search", response_class=HTMLResponse)
@@ -123,59 +313,45 @@ async def search(
     sort: str | None = None,
     verified: str | None = None,
     page: int = Query(1, ge=1),
+    after: str | None = None,
     db: AsyncSession = Depends(get_db),
 ):
-    query = select(Service).options(selectinload(Service.categories)).where(Service.status != "purged")
-    if q.strip():
-        # SECURITY: escape LIKE wildcards so user input is matched literally
-        pattern = f"%{escape_like(q.strip())}%"
-        query = query.where(Service.name.ilike(pattern, escape="\\") | Service.description.ilike(pattern, escape="\\"))
+    q = q.strip()
+    version = await _listing_version(db)
+    etag = _listing_etag(request, version)
+    if (not_modified := _not_modified(request, etag)) is not None:
+        return not_modified
+
+    query = (
+        select(Service)
+        .options(selectinload(Service.categories), raiseload("*"))
+        .where(Service.status != "purged")
+    )
+    if q:
+        query = query.where(search_filter(q, db.bind.dialect.name))
     if category:
-        query = query.join(service_categories).join(Category).where(Category.slug == category)
+        query = query.where(category_filter(category))
     if status:
         query = query.where(Service.status == status)
     if verified == "true":
         query = query.where(Service.domain_verified == True)
 
-    sort_map = {
-        "top-rated": Service.avg_rating.desc(),
-        "cheapest": Service.pricing_sats.asc(),
-        "most-reviewed": Service.rating_count.desc(),
-        "popular": Service.hit_count_30d.desc(),
-        "newest": Service.created_at.desc(),
-    }
-    # id.desc() tiebreak keeps ordering deterministic when primary keys collide
-    # (e.g. seed imports share a created_at, ratings share a count).
-    query = query.order_by(sort_map.get(sort, Service.hit_count_30d.desc()), Service.id.desc())
-
-    # Count total for pagination
-    count_q = select(func.count()).select_from(query.subquery())
-    total = (await db.execute(count_q)).scalar() or 0
-    total_pages = max(1, math.ceil(total / PAGE_SIZE))
-    page = min(page, total_pages)
+    services, page, total_pages, next_cursor = await _fetch_page(
+        db, query, sort, page, after, (version, q, category, status, verified, None),
+    )
 
-    services = (await db.execute(query.offset((page - 1) * PAGE_SIZE).limit(PAGE_SIZE))).scalars().all()
+    qs_base = _listing_qs(q, category, status, verified, sort)
 
-    # Build qs_base for pagination links
-    qs_parts = []
-    if q.strip():
-        qs_parts.append(f"q={q.strip()}")
-    if category:
-        qs_parts.append(f"category={category}")
-    if verified == "true":
-        qs_parts.append("verified=true")
-    elif status:
-        qs_parts.append(f"status={status}")
-    if sort:
-        qs_parts.append(f"sort={sort}")
-    qs_base = "&".join(qs_parts)
-
-    return templates.TemplateResponse(request, "services/_card_grid.html", {
+    response = templates.TemplateResponse(request, "services/_card_grid.html", {
         "services": services,
         "page": page,
         "total_pages": total_pages,
+        "next_cursor": next_cursor,
         "qs_base": qs_base,
     })
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = LISTING_CACHE_CONTROL
+    return response
 
 
 @router.get("/owner/{domain}", response_class=HTMLResponse)
@@ -187,7 +363,7 @@ async def owner_dashboard(
     db: AsyncSession = Depends(get_db),
 ):
     """Owner traffic dashboard. Requires edit token via ?token= query param."""
-    from app.utils import get_same_domain_services, verify_edit_token, extract_domain
+    from app.utils import get_same_domain_services, verify_edit_token_any, extract_domain
     from app.models import UsageDetail
 
     services = await get_same_domain_services(db, f"https://{domain}")
@@ -198,11 +374,7 @@ async def owner_dashboard(
     if payments_enabled():
         if not token:
             raise HTTPException(status_code=403, detail="Token required: /owner/{domain}?token=YOUR_EDIT_TOKEN")
-        verified = any(
-            s.edit_token_hash and verify_edit_token(token, s.edit_token_hash)
-            for s in services
-        )
-        if not verified:
+        if not verify_edit_token_any(token, (s.edit_token_hash for s in services)):
             raise HTTPException(status_code=403, detail="Invalid token for this domain")
 
     from datetime import timedelta
@@ -258,17 +430,19 @@ async def owner_dashboard(
 @router.get("/services/{slug}", response_class=HTMLResponse)
 @limiter.limit("30/minute")
 async def service_detail(request: Request, slug: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(Service)
-        .options(selectinload(Service.categories), selectinload(Service.ratings))
-        .where(Service.slug == slug)
-        .where(Service.status != "purged")
-    )
-    service = result.scalars().first()
+    # One row: join its categories in rather than a second SELECT ... IN
+    service = await _get_live_service(db, slug, joinedload(Service.categories), raiseload("*"))
     if not service:
         return HTMLResponse("<h1>Not Found</h1>", status_code=404)
+    recent_ratings = (await db.execute(
+        select(Rating)
+        .where(Rating.service_id == service.id)
+        .order_by(Rating.created_at.desc(), Rating.id.desc())
+        .limit(DETAIL_RATINGS_LIMIT)
+    )).scalars().all()
     return templates.TemplateResponse(request, "services/detail.html", {
         "service": service,
+        "recent_ratings": recent_ratings,
         "reputation_price_sats": settings.AUTH_REPUTATION_PRICE_SATS,
         "analytics_price_sats": settings.AUTH_SERVICE_ANALYTICS_PRICE_SATS,
         "meta_token": _meta_token(service.slug),
@@ -301,12 +475,7 @@ async def service_meta(request: Request, slug: str, db: AsyncSession = Depends(g
     if not token or not _hmac.compare_digest(token, expected):
         return JSONResponse({"error": "forbidden"}, status_code=403)
 
-    result = await db.execute(
-        select(Service)
-        .where(Service.slug == slug)
-        .where(Service.status != "purged")
-    )
-    service = result.scalars().first()
+    service = await _get_live_service(db, slug)
     if not service:
         return JSONResponse({"error": "not found"}, status_code=404)
     data = {
@@ -330,7 +499,7 @@ async def service_meta(request: Request, slug: str, db: AsyncSession = Depends(g
 
 @router.get("/submit", response_class=HTMLResponse)
 async def submit_form(request: Request, db: AsyncSession = Depends(get_db)):
-    categories = (await db.execute(select(Category).order_by(Category.name))).scalars().all()
+    categories = await _get_categories(db)
     return templates.TemplateResponse(request, "services/submit.html", {
         "categories": categories,
     })
@@ -338,7 +507,7 @@ async def submit_form(request: Request, db: AsyncSession = Depends(get_db)):
 
 @router.get("/submit/recover", response_class=HTMLResponse)
 async def submit_recover_form(request: Request, db: AsyncSession = Depends(get_db)):
-    categories = (await db.execute(select(Category).order_by(Category.name))).scalars().all()
+    categories = await _get_categories(db)
     return templates.TemplateResponse(request, "services/submit.html", {
         "categories": categories,
         "recovery_mode": True,
@@ -369,7 +538,7 @@ async def submit_service(
     db: AsyncSession = Depends(get_db),
 ):
     form_data = await request.form()
-    category_ids = [int(v) for k, v in form_data.multi_items() if k == "categories"]
+    category_ids = [int(v) for v in form_data.getlist("categories") if v.isdecimal()]
 
     # Recovery flow: payment_hash arrives in query (normal re-POST from payment page)
     # or in form body (user re-submitting via /submit/recover after UI timeout).
@@ -377,7 +546,7 @@ async def submit_service(
     recovery_mode = bool(form_data.get("payment_hash"))
 
     async def _render_error(msg: str, status_code: int = 422, **extra):
-        cats = (await db.execute(select(Category).order_by(Category.name))).scalars().all()
+        cats = await _get_categories(db)
         return templates.TemplateResponse(request, "services/submit.html", {
             "categories": cats,
             "error": msg,
@@ -403,25 +572,24 @@ async def submit_service(
 
     # SECURITY: Server-side length limits prevent DB bloat and memory exhaustion.
     # HTML maxlength is client-side only and trivially bypassed. Constants in config.py.
-    LENGTH_LIMITS = {
-        "name": MAX_NAME, "url": MAX_URL, "description": MAX_DESCRIPTION,
-        "owner_name": MAX_OWNER_NAME, "owner_contact": MAX_OWNER_CONTACT,
-        "logo_url": MAX_LOGO_URL, "x402_network": MAX_X402_NETWORK,
-        "x402_asset": MAX_X402_ASSET, "x402_pay_to": MAX_X402_PAY_TO,
-        "pricing_usd": MAX_PRICING_USD,
-        "mpp_method": MAX_MPP_METHOD, "mpp_realm": MAX_MPP_REALM,
-        "mpp_currency": MAX_MPP_CURRENCY,
+    fields = {
+        "name": name, "url": url, "description": description,
+        "owner_name": owner_name, "owner_contact": owner_contact,
+        "logo_url": logo_url, "x402_network": x402_network,
+        "x402_asset": x402_asset, "x402_pay_to": x402_pay_to,
+        "pricing_usd": pricing_usd,
+        "mpp_method": mpp_method, "mpp_realm": mpp_realm,
+        "mpp_currency": mpp_currency,
     }
-    for field_name, max_len in LENGTH_LIMITS.items():
-        val = locals()[field_name]
-        if len(val) > max_len:
+    for field_name, max_len in SUBMIT_LENGTH_LIMITS:
+        if len(fields[field_name]) > max_len:
             return await _render_error(f"{field_name} exceeds maximum length of {max_len} characters.")
 
     # SECURITY: Reject non-http(s) schemes to prevent stored XSS via javascript:/data: URIs
     parsed_url = urlparse(url)
     parsed_logo = urlparse(logo_url) if logo_url else None
-    if parsed_url.scheme not in ("http", "https") or (
-        parsed_logo and parsed_logo.scheme not in ("http", "https")
+    if parsed_url.scheme not in ALLOWED_URL_SCHEMES or (
+        parsed_logo and parsed_logo.scheme not in ALLOWED_URL_SCHEMES
     ):
         return await _render_error("URL and logo URL must start with http:// or https://")
 
@@ -508,22 +676,18 @@ async def submit_service(
                 status_code=402,
             )
 
-    slug = await unique_slug(db, name)
-
-    # Fetch same-domain services (used for token reuse + auto-verify)
-    domain_services = await get_same_domain_services(db, url)
-
-    # Check if existing token matches a same-domain service
-    token_reused = False
-    if existing_edit_token:
-        for ds in domain_services:
-            if ds.edit_token_hash and verify_edit_token(existing_edit_token, ds.edit_token_hash):
-                token_reused = True
-                break
+    # Same-domain services (token reuse + auto-verify) and any purged row with
+    # this URL (overwritten instead of creating a new one), in one query
+    domain_services, purged = await get_domain_services_and_purged(db, url)
 
+    # Reuse the existing token if it matches a same-domain service; the token
+    # is hashed once and compared against every row's hash
+    token_reused = bool(existing_edit_token) and verify_edit_token_any(
+        existing_edit_token, [ds.edit_token_hash for ds in domain_services]
+    )
     if token_reused:
         edit_token = existing_edit_token
-        edit_token_hash = ds.edit_token_hash
+        edit_token_hash = hash_token(edit_token)
     else:
         edit_token = generate_edit_token()
         edit_token_hash = hash_token(edit_token)
@@ -537,12 +701,10 @@ async def submit_service(
             inherited_challenge = ds.domain_challenge
             break
 
-    # Check for purged service with the same URL — overwrite instead of creating new
-    purged = await find_purged_service(db, url)
     if purged:
         await overwrite_purged_service(
             db, purged,
-            name=name, slug=slug, description=description,
+            name=name, slug=await unique_slug(db, name), description=description,
             pricing_sats=pricing_sats, pricing_model=pricing_model,
             protocol=protocol, owner_name=owner_name, owner_contact=owner_contact,
             logo_url=logo_url, edit_token_hash=edit_token_hash,
@@ -555,7 +717,7 @@ async def submit_service(
         service = purged
     else:
         service = Service(
-            name=name, slug=slug, url=url, description=description,
+            name=name, url=url, description=description,
             protocol=protocol, pricing_sats=pricing_sats, pricing_model=pricing_model,
             owner_name=owner_name, owner_contact=owner_contact, logo_url=logo_url,
             x402_network=x402_network or None, x402_asset=x402_asset or None,
@@ -566,10 +728,10 @@ async def submit_service(
             domain_verified=auto_verified,
             domain_challenge=inherited_challenge,
         )
+        cats = []
         if category_ids:
             cats = (await db.execute(select(Category).where(Category.id.in_(category_ids)))).scalars().all()
-            service.categories = list(cats)
-        db.add(service)
+        await flush_with_unique_slug(db, service, name, cats)
 
     try:
         await db.commit()
@@ -597,6 +759,21 @@ EDITABLE_FIELDS = {
 }
 
 
+async def _get_service_for_token(db: AsyncSession, slug: str, token: str) -> Service | None:
+    """Load a live service only if the edit token matches, in a single query.
+
+    Returns None for an unknown slug or a wrong token; callers fall back to a
+    plain slug lookup to tell 404 from 403.
+    """
+    result = await db.execute(
+        select(Service).options(selectinload(Service.categories))
+        .where(Service.slug == slug)
+        .where(Service.edit_token_hash == hash_token(token))
+        .where(Service.status != "purged")
+    )
+    return result.scalars().first()
+
+
 @router.get("/services/{slug}/edit", response_class=HTMLResponse)
 async def edit_service_form(
     request: Request,
@@ -604,21 +781,15 @@ async def edit_service_form(
     token: str | None = None,
     db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(
-        select(Service).options(selectinload(Service.categories))
-        .where(Service.slug == slug)
-        .where(Service.status != "purged")
-    )
-    service = result.scalars().first()
-    if not service:
-        return HTMLResponse("<h1>Not Found</h1>", status_code=404)
-
-    categories = (await db.execute(select(Category).order_by(Category.name))).scalars().all()
-    token_valid = (
-        token is not None
-        and service.edit_token_hash is not None
-        and verify_edit_token(token, service.edit_token_hash)
-    )
+    service = await _get_service_for_token(db, slug, token) if token else None
+    token_valid = service is not None
+    if not token_valid:
+        # Token prompt only needs the listing's name/slug, not its categories
+        service = await _get_live_service(db, slug)
+        if not service:
+            return HTMLResponse("<h1>Not Found</h1>", status_code=404)
+
+    categories = await _get_categories(db) if token_valid else []
     token_invalid = token is not None and not token_valid
     return templates.TemplateResponse(request, "services/edit.html", {
         "service": service,
@@ -652,26 +823,32 @@ async def edit_service(
     mpp_currency: str = Form(""),
     db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(
-        select(Service).options(selectinload(Service.categories))
-        .where(Service.slug == slug)
-        .where(Service.status != "purged")
-    )
-    service = result.scalars().first()
+    service = await _get_service_for_token(db, slug, edit_token) if edit_token else None
     if not service:
-        return HTMLResponse("<h1>Not Found</h1>", status_code=404)
-    if not service.edit_token_hash or not verify_edit_token(edit_token, service.edit_token_hash):
-        categories = (await db.execute(select(Category).order_by(Category.name))).scalars().all()
+        service = await _get_live_service(db, slug)
+        if not service:
+            return HTMLResponse("<h1>Not Found</h1>", status_code=404)
         return templates.TemplateResponse(request, "services/edit.html", {
             "service": service,
-            "categories": categories,
+            "categories": [],
             "token_valid": False,
             "token_invalid": True,
             "token": "",
         }, status_code=403)
 
     form_data = await request.form()
-    category_ids = [int(v) for k, v in form_data.multi_items() if k == "categories"]
+    category_ids = [int(v) for v in form_data.getlist("categories") if v.isdecimal()]
+
+    async def _render_error(msg: str):
+        return templates.TemplateResponse(request, "services/edit.html", {
+            "service": service,
+            "categories": await _get_categories(db),
+            "token_valid": True,
+            "token_invalid": False,
+            "token": edit_token,
+            "error": msg,
+            "selected_category_ids": category_ids,
+        }, status_code=422)
 
     # Validate category count (1–2 required)
     if len(category_ids) < 1 or len(category_ids) > 2:
@@ -685,16 +862,7 @@ async def edit_service(
         service.owner_name = owner_name
         service.owner_contact = owner_contact
         service.logo_url = logo_url
-        categories = (await db.execute(select(Category).order_by(Category.name))).scalars().all()
-        return templates.TemplateResponse(request, "services/edit.html", {
-            "service": service,
-            "categories": categories,
-            "token_valid": True,
-            "token_invalid": False,
-            "token": edit_token,
-            "error": "Select 1–2 categories.",
-            "selected_category_ids": category_ids,
-        }, status_code=422)
+        return await _render_error("Select 1–2 categories.")
 
     if name:
         service.name = name
@@ -730,33 +898,20 @@ async def edit_service(
         if not service.pricing_usd:
             missing.append("USD price")
         if missing:
-            categories = (await db.execute(select(Category).order_by(Category.name))).scalars().all()
-            return templates.TemplateResponse(request, "services/edit.html", {
-                "service": service,
-                "categories": categories,
-                "token_valid": True,
-                "token_invalid": False,
-                "token": edit_token,
-                "error": f"{', '.join(missing)} required for x402 protocol.",
-                "selected_category_ids": category_ids,
-            }, status_code=422)
+            return await _render_error(f"{', '.join(missing)} required for x402 protocol.")
 
     # Validate MPP fields when protocol includes MPP
     if "MPP" in edit_parts:
         if not service.mpp_method:
-            categories = (await db.execute(select(Category).order_by(Category.name))).scalars().all()
-            return templates.TemplateResponse(request, "services/edit.html", {
-                "service": service,
-                "categories": categories,
-                "token_valid": True,
-                "token_invalid": False,
-                "token": edit_token,
-                "error": "Payment method required for MPP protocol.",
-                "selected_category_ids": category_ids,
-            }, status_code=422)
+            return await _render_error("Payment method required for MPP protocol.")
 
-    cats = (await db.execute(select(Category).where(Category.id.in_(category_ids)))).scalars().all()
-    service.categories = list(cats)
+    # Unchanged categories: skip the lookup and the service_categories rewrite
+    if set(category_ids) != {c.id for c in service.categories}:
+        cats = (await db.execute(select(Category).where(Category.id.in_(category_ids)))).scalars().all()
+        service.categories = list(cats)
+        # Category links live in service_categories, so bump the row's updated_at
+        # explicitly; the directory ETag keys off it
+        service.updated_at = utc_now()
 
     await db.commit()
     return RedirectResponse(f"/services/{slug}", status_code=303)
@@ -770,10 +925,7 @@ async def delete_service(
     edit_token: str = Form(""),
     db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(
-        select(Service).where(Service.slug == slug).where(Service.status != "purged")
-    )
-    service = result.scalars().first()
+    service = await _get_live_service(db, slug)
     if not service:
         return HTMLResponse("<h1>Not Found</h1>", status_code=404)
     if not service.edit_token_hash or not verify_edit_token(edit_token, service.edit_token_hash):
@@ -790,10 +942,7 @@ async def recover_form(
     slug: str,
     db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(
-        select(Service).where(Service.slug == slug).where(Service.status != "purged")
-    )
-    service = result.scalars().first()
+    service = await _get_live_service(db, slug)
     if not service:
         return HTMLResponse("<h1>Not Found</h1>", status_code=404)
 
@@ -820,17 +969,13 @@ async def recover_service(
     action: str = Form(...),
     db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(
-        select(Service).where(Service.slug == slug).where(Service.status != "purged")
-    )
-    service = result.scalars().first()
+    service = await _get_live_service(db, slug)
     if not service:
         return HTMLResponse("<h1>Not Found</h1>", status_code=404)
 
     verify_path = f"{domain_root(service.url)}/.well-known/satring-verify"
 
     if action == "generate":
-        import secrets
         challenge = secrets.token_hex(32)
         service.domain_challenge = challenge
         service.domain_challenge_expires_at = utc_now() + timedelta(minutes=30)
@@ -868,9 +1013,7 @@ async def recover_service(
             })
 
         try:
-            async with httpx.AsyncClient(timeout=10) as http:
-                resp = await http.get(verify_path)
-            fetched = resp.text.strip()
+            fetched = await fetch_verify_challenge(verify_path)
         except Exception:
             return templates.TemplateResponse(request, "services/recover.html", {
                 "service": service,
@@ -917,10 +1060,7 @@ async def rate_service(
     reviewer_name: str = Form("Anonymous"),
     db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(
-        select(Service).where(Service.slug == slug).where(Service.status != "purged")
-    )
-    service = result.scalars().first()
+    service = await _get_live_service(db, slug)
     if not service:
         return HTMLResponse("Not Found", status_code=404)
 
@@ -934,6 +1074,8 @@ async def rate_service(
         return HTMLResponse("Input exceeds maximum length.", status_code=422)
 
     # Payment gate (skipped in test mode)
+    service_id = service.id
+    payment_hash = None
     if payments_enabled():
         payment_hash = request.query_params.get("payment_hash")
         if not payment_hash:
@@ -965,6 +1107,15 @@ async def rate_service(
                 status_code=402,
             )
         if not await check_and_consume_payment(payment_hash, db):
+            # A resubmitted form (double click, dropped response) carries the
+            # same invoice: show the review it already paid for
+            existing = (await db.execute(
+                select(Rating).where(Rating.service_id == service_id, Rating.payment_hash == payment_hash)
+            )).scalars().first()
+            if existing:
+                return templates.TemplateResponse(request, "services/_review_bubble.html", {
+                    "rating": existing,
+                })
             return HTMLResponse(
                 '<div class="text-red-400 text-sm">Payment already used.</div>',
                 status_code=402,
@@ -975,17 +1126,9 @@ async def rate_service(
         score=score,
         comment=comment,
         reviewer_name=reviewer_name or "Anonymous",
+        payment_hash=payment_hash,
     )
-    db.add(rating)
-    await db.flush()
-
-    avg_result = await db.execute(
-        select(func.avg(Rating.score), func.count(Rating.id))
-        .where(Rating.service_id == service.id)
-    )
-    avg_row = avg_result.one()
-    service.avg_rating = round(float(avg_row[0]), 1)
-    service.rating_count = avg_row[1]
+    await add_rating(db, service, rating)
     await db.commit()
 
     return templates.TemplateResponse(request, "services/_review_bubble.html", {
@@ -995,11 +1138,7 @@ async def rate_service(
 
 @router.get("/services/{slug}/reputation-invoice", response_class=HTMLResponse)
 async def reputation_invoice(request: Request, slug: str, db: AsyncSession = Depends(get_db)):
-    # Verify service exists
-    result = await db.execute(
-        select(Service).where(Service.slug == slug).where(Service.status != "purged")
-    )
-    if not result.scalars().first():
+    if not await _get_live_service(db, slug):
         return HTMLResponse("Not Found", status_code=404)
 
     if not payments_enabled():
@@ -1040,11 +1179,7 @@ async def reputation_result(request: Request, slug: str, payment_hash: str = "",
 
 @router.get("/services/{slug}/analytics-invoice", response_class=HTMLResponse)
 async def service_analytics_invoice(request: Request, slug: str, db: AsyncSession = Depends(get_db)):
-    # Verify service exists
-    result = await db.execute(
-        select(Service).where(Service.slug == slug).where(Service.status != "purged")
-    )
-    if not result.scalars().first():
+    if not await _get_live_service(db, slug):
         return HTMLResponse("Not Found", status_code=404)
 
     if not payments_enabled():
@@ -1119,13 +1254,23 @@ async def analytics_result(request: Request, payment_hash: str = "", db: AsyncSe
     return templates.TemplateResponse(request, "services/_analytics_result.html", {"data": data})
 
 
+_PAYMENT_STATUS_BODIES = {True: b'{"paid":true}', False: b'{"paid":false}'}
+
+
 @router.get("/payment-status/{payment_hash}")
 @limiter.limit(RATE_PAYMENT_STATUS)
 async def payment_status(request: Request, payment_hash: str):
     if not payments_enabled():
-        return JSONResponse({"paid": True})
-    paid, _ = await check_payment_status(payment_hash)
-    return JSONResponse({"paid": paid})
+        paid = True
+    else:
+        paid, _ = await check_payment_status(payment_hash)
+    # Polled every few seconds while an invoice is open: serve one of two
+    # prebuilt bodies, and never let a cache answer for the payment backend
+    return Response(
+        _PAYMENT_STATUS_BODIES[bool(paid)],
+        media_type="application/json",
+        headers={"Cache-Control": "no-store"},
+    )
 
 
 @router.get("/")
@@ -1284,10 +1429,25 @@ async def stats_page(request: Request, db: AsyncSession = Depends(get_db)):
     })
 
 
-@router.get("/sitemap.xml")
-@limiter.limit(RATE_SITEMAP)
-async def sitemap(request: Request, db: AsyncSession = Depends(get_db)):
-    from fastapi.responses import Response
+# sitemap.xml, robots.txt and llms.txt depend only on BASE_URL and the seed
+# categories, both fixed at startup: build each body (already encoded) and its
+# ETag once
+STATIC_TEXT_CACHE_CONTROL = "public, max-age=3600"
+
+
+def _static_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _static_text_response(request: Request, body: bytes, etag: str, media_type: str) -> Response:
+    if (not_modified := _not_modified(request, etag, STATIC_TEXT_CACHE_CONTROL)) is not None:
+        return not_modified
+    return Response(content=body, media_type=media_type, headers={
+        "ETag": etag, "Cache-Control": STATIC_TEXT_CACHE_CONTROL,
+    })
+
+
+def _build_sitemap_xml() -> str:
     base = settings.BASE_URL.rstrip("/")
 
     urls = [
@@ -1307,7 +1467,17 @@ async def sitemap(request: Request, db: AsyncSession = Depends(get_db)):
     xml += '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
     xml += '\n'.join(urls)
     xml += '\n</urlset>'
-    return Response(content=xml, media_type="application/xml")
+    return xml
+
+
+_SITEMAP_XML = _build_sitemap_xml().encode()
+_SITEMAP_ETAG = _static_etag(_SITEMAP_XML)
+
+
+@router.get("/sitemap.xml")
+@limiter.limit(RATE_SITEMAP)
+async def sitemap(request: Request):
+    return _static_text_response(request, _SITEMAP_XML, _SITEMAP_ETAG, "application/xml")
 
 
 @router.get("/privacy", response_class=HTMLResponse)
@@ -1315,8 +1485,7 @@ async def privacy_page(request: Request):
     return templates.TemplateResponse(request, "privacy.html")
 
 
-@router.get("/robots.txt")
-async def robots_txt():
+def _build_robots_txt() -> str:
     base = settings.BASE_URL.rstrip("/")
     content = (
         "User-agent: *\n"
@@ -1337,14 +1506,19 @@ async def robots_txt():
         f"Sitemap: {base}/sitemap.xml\n"
         f"Llms-txt: {base}/llms.txt\n"
     )
-    from fastapi.responses import PlainTextResponse
-    return PlainTextResponse(content)
+    return content
 
 
-@router.get("/llms.txt")
-async def llms_txt():
-    from fastapi.responses import PlainTextResponse
-    from app.main import SEED_CATEGORIES
+_ROBOTS_TXT = _build_robots_txt().encode()
+_ROBOTS_ETAG = _static_etag(_ROBOTS_TXT)
+
+
+@router.get("/robots.txt")
+async def robots_txt(request: Request):
+    return _static_text_response(request, _ROBOTS_TXT, _ROBOTS_ETAG, "text/plain")
+
+
+def _build_llms_txt() -> str:
     base = settings.BASE_URL.rstrip("/")
 
     lines = [
@@ -1422,7 +1596,16 @@ async def llms_txt():
         f"- Discovery: {base}/.well-known/x402",
         "",
     ])
-    return PlainTextResponse("\n".join(lines), media_type="text/plain")
+    return "\n".join(lines)
+
+
+_LLMS_TXT = _build_llms_txt().encode()
+_LLMS_ETAG = _static_etag(_LLMS_TXT)
+
+
+@router.get("/llms.txt")
+async def llms_txt(request: Request):
+    return _static_text_response(request, _LLMS_TXT, _LLMS_ETAG, "text/plain")
 
 
 # --- Well-known protocol discovery routes ---
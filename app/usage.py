@@ -4,7 +4,7 @@ import re
 from collections import defaultdict
 from datetime import datetime, timedelta
 
-from app.utils import utc_now
+from app.utils import bump_services_version, utc_now
 
 import sqlalchemy
 from sqlalchemy import delete, select
@@ -337,6 +337,8 @@ async def _update_service_hit_counts() -> None:
             WHERE status != 'purged'
         """), {"seven_ago": seven_ago, "thirty_ago": thirty_ago})
         await db.commit()
+    # Raw SQL skips the ORM events (and updated_at), but reorders "popular" listings
+    bump_services_version()
 
 
 async def _flush_loop() -> None:
@@ -1,5 +1,6 @@
 from datetime import datetime, timezone
 
+import functools
 import hashlib
 import hmac
 import ipaddress
@@ -13,10 +14,15 @@ import socket
 from email.mime.text import MIMEText
 from urllib.parse import urlparse
 
-from sqlalchemy import select, func
+import httpx
+
+from sqlalchemy import event, insert, select, func, literal_column, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 
-from app.models import Service, Category, Rating
+from app.models import Service, Category, Rating, search_document, service_categories
 
 
 def utc_now() -> datetime:
@@ -24,6 +30,45 @@ def utc_now() -> datetime:
     return datetime.now(timezone.utc)
 
 
+# In-process version of the services table, part of the directory/search ETag
+# (see _listing_version in routes/web.py). The session events below bump it on
+# every ORM write to services: at flush, and again at commit/rollback so a count
+# cached mid-transaction is not reused. Raw-SQL writers (the usage hit-count
+# flush) call bump_services_version() themselves.
+_services_version = 0
+
+
+def services_version() -> int:
+    return _services_version
+
+
+def bump_services_version() -> None:
+    global _services_version
+    _services_version += 1
+
+
+@event.listens_for(Session, "after_flush")
+def _track_service_flush(session, flush_context):
+    if any(isinstance(obj, Service) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["services_written"] = True
+        bump_services_version()
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_service_statements(orm_execute_state):
+    state = orm_execute_state
+    if (state.is_insert or state.is_update or state.is_delete) and state.bind_mapper is Service.__mapper__:
+        state.session.info["services_written"] = True
+        bump_services_version()
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _track_service_transaction_end(session):
+    if session.info.pop("services_written", False):
+        bump_services_version()
+
+
 BASE_PROTOCOLS = ("L402", "x402", "MPP")
 _PROTO_ORDER = {"L402": 0, "x402": 1, "MPP": 2}
 
@@ -70,6 +115,36 @@ def protocol_filter(column, protocol: str):
     return column.in_(matching)
 
 
+def category_filter(category_slug: str):
+    """Return a filter clause matching services linked to the given category.
+
+    EXISTS keeps the outer query on one row per service (no join fan-out)
+    and lets the planner resolve it as a semi-join on service_categories.
+    """
+    return (
+        select(service_categories.c.service_id)
+        .join(Category, Category.id == service_categories.c.category_id)
+        .where(service_categories.c.service_id == Service.id, Category.slug == category_slug)
+        .exists()
+    )
+
+
+def search_filter(q: str, dialect_name: str):
+    """Return a filter clause for a free-text service search.
+
+    Always matches `q` as a literal substring of name or description. On
+    Postgres it also matches stemmed words ("payments" finds "payment")
+    through the full-text index on search_document().
+    """
+    # SECURITY: escape LIKE wildcards so user input is matched literally
+    pattern = f"%{escape_like(q)}%"
+    clause = Service.name.ilike(pattern, escape="\\") | Service.description.ilike(pattern, escape="\\")
+    if dialect_name == "postgresql":
+        tsquery = func.websearch_to_tsquery(literal_column("'english'"), q)
+        clause = search_document(Service.name, Service.description).bool_op("@@")(tsquery) | clause
+    return clause
+
+
 def escape_like(s: str, escape: str = "\\") -> str:
     """SECURITY: Escape SQL LIKE metacharacters (%, _, \\) in user input
     so they are matched literally instead of acting as wildcards."""
@@ -79,14 +154,41 @@ def escape_like(s: str, escape: str = "\\") -> str:
     return s
 
 
+_SLUG_SEPARATORS_RE = re.compile(r"[./:]+")
+_SLUG_INVALID_RE = re.compile(r"[^\w\s-]")
+_SLUG_SPACES_RE = re.compile(r"[\s_]+")
+_SLUG_DASHES_RE = re.compile(r"-+")
+
+# ASCII fast path: separators, whitespace and "_" become dashes, other
+# punctuation is dropped, letters/digits/dashes pass through unchanged
+_SLUG_ASCII_TABLE = {
+    c: "-" if chr(c) in "./:_" or chr(c).isspace() else None
+    for c in range(128)
+    if not (chr(c).isalnum() or chr(c) == "-")
+}
+
+
 def slugify(text: str) -> str:
+    # Already slug-shaped ([a-z0-9-], no edge or doubled dashes): nothing to do
+    if (text.isascii() and text.islower() and text.replace("-", "").isalnum()
+            and "--" not in text and text[0] != "-" and text[-1] != "-"):
+        return text
     slug = text.lower().strip()
+    if not slug.isascii():
+        return _slugify_unicode(slug)
+    slug = slug.translate(_SLUG_ASCII_TABLE)
+    while "--" in slug:
+        slug = slug.replace("--", "-")
+    return slug.strip("-")
+
+
+def _slugify_unicode(slug: str) -> str:
     # Turn punctuation that separates words (dots, slashes, colons) into spaces
     # so they become dashes rather than being silently removed
-    slug = re.sub(r"[./:]+", " ", slug)
-    slug = re.sub(r"[^\w\s-]", "", slug)
-    slug = re.sub(r"[\s_]+", "-", slug)
-    slug = re.sub(r"-+", "-", slug).strip("-")
+    slug = _SLUG_SEPARATORS_RE.sub(" ", slug)
+    slug = _SLUG_INVALID_RE.sub("", slug)
+    slug = _SLUG_SPACES_RE.sub("-", slug)
+    slug = _SLUG_DASHES_RE.sub("-", slug).strip("-")
     return slug
 
 
@@ -94,7 +196,9 @@ def generate_edit_token() -> str:
     return secrets.token_urlsafe(32)
 
 
+@functools.lru_cache(maxsize=1024)
 def hash_token(token: str) -> str:
+    # Memoized: edit flows re-verify the same token on every form round trip
     return hashlib.sha256(token.encode()).hexdigest()
 
 
@@ -102,8 +206,39 @@ def verify_edit_token(plaintext: str, stored_hash: str) -> bool:
     return hmac.compare_digest(hash_token(plaintext), stored_hash)
 
 
+def verify_edit_token_any(plaintext: str, stored_hashes) -> bool:
+    """True if the token matches any of the stored hashes. Hashes the token once."""
+    candidate = hash_token(plaintext)
+    return any(h and hmac.compare_digest(candidate, h) for h in stored_hashes)
+
+
+_SCHEME_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789+-.")
+_PLAIN_HOST_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789.-")
+
+
 def extract_domain(url: str) -> str:
-    """Extract the hostname from a URL."""
+    """Extract the (lowercased) hostname from a URL.
+
+    Plain scheme://[user@]host[:port] URLs are sliced directly; anything else
+    (IPv6 literals, escapes, odd schemes, no scheme) goes through urlparse, so
+    the result always matches urlparse(url).hostname.
+    """
+    i = url.find("://")
+    if i > 0 and url[0].isalpha() and _SCHEME_CHARS.issuperset(url[:i]):
+        start = i + 3
+        end = len(url)
+        for ch in "/?#":
+            j = url.find(ch, start, end)
+            if j != -1:
+                end = j
+        host = url[start:end]
+        host = host[host.rfind("@") + 1:]
+        colon = host.find(":")
+        if colon != -1:
+            host = host[:colon]
+        host = host.lower()
+        if host and _PLAIN_HOST_CHARS.issuperset(host):
+            return host
     return urlparse(url).hostname or ""
 
 
@@ -128,31 +263,96 @@ def is_public_hostname(hostname: str) -> bool:
     return ip.is_global
 
 
+# The verify file holds a 64-hex-char challenge; anything past this can't match
+VERIFY_MAX_BYTES = 4096
+_verify_client: httpx.AsyncClient | None = None
+
+
+async def fetch_verify_challenge(url: str) -> str:
+    """GET a domain's satring-verify file and return its stripped contents.
+
+    Uses one shared client (created on first use, closed by
+    close_verify_client at shutdown) so repeat verifications reuse
+    connections and concurrent ones share a bounded pool. Reads at most
+    VERIFY_MAX_BYTES. Callers must run the is_public_hostname SSRF check first.
+    """
+    global _verify_client
+    if _verify_client is None:
+        _verify_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            follow_redirects=False,
+        )
+    body = b""
+    async with _verify_client.stream("GET", url) as resp:
+        async for chunk in resp.aiter_bytes():
+            body += chunk
+            if len(body) >= VERIFY_MAX_BYTES:
+                break
+    return body[:VERIFY_MAX_BYTES].decode("utf-8", errors="replace").strip()
+
+
+async def close_verify_client() -> None:
+    global _verify_client
+    if _verify_client is not None:
+        await _verify_client.aclose()
+        _verify_client = None
+
+
 async def get_same_domain_services(db: AsyncSession, url: str) -> list[Service]:
     """Return all services whose URL is on the same domain as `url`."""
     domain = extract_domain(url)
     if not domain:
         return []
-    # Broad LIKE filter, then exact post-filter on parsed hostname
     result = await db.execute(
-        select(Service).where(Service.url.ilike(f"%{escape_like(domain)}%", escape="\\")).where(Service.status != "purged")
+        select(Service).where(Service.domain == domain, Service.status != "purged")
     )
-    return [s for s in result.scalars().all() if extract_domain(s.url) == domain]
+    return list(result.scalars().all())
 
 
 async def unique_slug(db: AsyncSession, text: str) -> str:
     base = slugify(text)
-    slug = base
-    result = await db.execute(select(Service).where(Service.slug == slug))
-    if result.scalars().first() is None:
-        return slug
+    # One query for the base and every base-N candidate, then pick locally
+    result = await db.execute(
+        select(Service.slug).where(
+            (Service.slug == base) | Service.slug.like(f"{escape_like(base)}-%", escape="\\")
+        )
+    )
+    taken = set(result.scalars().all())
+    if base not in taken:
+        return base
     counter = 1
-    while True:
-        slug = f"{base}-{counter}"
-        result = await db.execute(select(Service).where(Service.slug == slug))
-        if result.scalars().first() is None:
-            return slug
+    while f"{base}-{counter}" in taken:
         counter += 1
+    return f"{base}-{counter}"
+
+
+async def flush_with_unique_slug(
+    db: AsyncSession, service: Service, text: str,
+    categories: list[Category] | None = None, attempts: int = 5,
+) -> None:
+    """Add and flush a new service under text's slug, suffixing it only on collision.
+
+    The slug's UNIQUE index does the check: a free slug costs no SELECT, and
+    two submissions racing for one slug can't both get it. The service (and
+    its categories) is added inside the SAVEPOINT, since begin_nested first
+    flushes whatever is already pending, so a collision rolls back only this
+    INSERT and retries with unique_slug's pick.
+    """
+    service.slug = slugify(text)
+    for attempt in range(attempts):
+        try:
+            async with db.begin_nested():
+                db.add(service)
+                if categories:
+                    service.categories = list(categories)
+                await db.flush()
+            return
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+            with db.no_autoflush:
+                service.slug = await unique_slug(db, text)
 
 
 def normalize_url(url: str) -> str:
@@ -192,6 +392,33 @@ async def find_purged_service(db: AsyncSession, url: str) -> Service | None:
     return result.scalars().first()
 
 
+async def get_domain_services_and_purged(db: AsyncSession, url: str) -> tuple[list, Service | None]:
+    """Same-domain services and any purged service with this URL, in one scan.
+
+    The domain services come back as light rows (edit_token_hash,
+    domain_verified, domain_challenge): submit only checks token reuse and
+    verification against them. A purged row with this exact URL is on the same
+    domain too; only that one is loaded as a full Service, to be overwritten.
+    """
+    domain = extract_domain(url)
+    if not domain:
+        return [], await find_purged_service(db, url)
+    result = await db.execute(
+        select(
+            Service.id, Service.url, Service.status,
+            Service.edit_token_hash, Service.domain_verified, Service.domain_challenge,
+        ).where(Service.domain == domain)
+    )
+    domain_services, purged_id = [], None
+    for row in result.all():
+        if row.status != "purged":
+            domain_services.append(row)
+        elif purged_id is None and row.url == url:
+            purged_id = row.id
+    purged = await db.get(Service, purged_id) if purged_id is not None else None
+    return domain_services, purged
+
+
 async def overwrite_purged_service(
     db: AsyncSession,
     service: Service,
@@ -252,13 +479,108 @@ async def overwrite_purged_service(
         service.categories = list(cats)
 
     # Recalculate avg_rating / rating_count from preserved ratings
-    avg_result = await db.execute(
-        select(func.avg(Rating.score), func.count(Rating.id))
-        .where(Rating.service_id == service.id)
+    await recalc_rating_stats(db, service)
+
+
+async def recalc_rating_stats(db: AsyncSession, service: Service) -> None:
+    """Recompute a service's avg_rating / rating_count / rating_sum from its ratings.
+
+    One UPDATE ... RETURNING with the aggregates as subqueries, so the read and
+    the write happen in a single statement and round trip.
+    """
+    of_service = Rating.service_id == service.id
+    result = await db.execute(
+        update(Service)
+        .where(Service.id == service.id)
+        .values(
+            avg_rating=select(
+                func.coalesce(func.round(func.avg(Rating.score), 1), literal_column("0"))
+            ).where(of_service).scalar_subquery(),
+            rating_count=select(func.count(Rating.id)).where(of_service).scalar_subquery(),
+            rating_sum=select(
+                func.coalesce(func.sum(Rating.score), literal_column("0"))
+            ).where(of_service).scalar_subquery(),
+        )
+        .returning(Service.avg_rating, Service.rating_count, Service.rating_sum)
+        .execution_options(synchronize_session=False)
     )
-    row = avg_result.one()
-    service.avg_rating = round(float(row[0]), 1) if row[0] else 0.0
-    service.rating_count = row[1] or 0
+    _set_rating_stats(service, result.one())
+
+
+async def add_rating_to_stats(db: AsyncSession, service: Service, score: int) -> None:
+    """Fold one new rating into a service's avg_rating / rating_count.
+
+    Atomic O(1) UPDATE on the running rating_sum, rather than re-aggregating
+    every rating like recalc_rating_stats; concurrent ratings can't lose counts.
+    """
+    result = await db.execute(_rating_stats_update(service.id, score))
+    _set_rating_stats(service, result.one())
+
+
+async def add_rating(db: AsyncSession, service: Service, rating: Rating) -> None:
+    """Insert a new (transient) rating and fold it into the service's stats.
+
+    On Postgres the INSERT runs as a data-modifying CTE of the stats UPDATE, so
+    both writes are one statement; other dialects flush the rating first. The
+    rating ends up persistent in ``db`` either way.
+    """
+    if db.bind.dialect.name != "postgresql":
+        db.add(rating)
+        await db.flush()
+        await add_rating_to_stats(db, service, rating.score)
+        return
+
+    if rating.created_at is None:
+        rating.created_at = utc_now()
+    new_rating = (
+        insert(Rating)
+        .values(
+            service_id=service.id,
+            score=rating.score,
+            comment=rating.comment,
+            reviewer_name=rating.reviewer_name,
+            payment_hash=rating.payment_hash,
+            created_at=rating.created_at,
+        )
+        .returning(Rating.id)
+        .cte("new_rating")
+    )
+    stmt = (
+        _rating_stats_update(service.id, rating.score)
+        .add_cte(new_rating)
+        .returning(select(new_rating.c.id).scalar_subquery().label("rating_id"))
+    )
+    row = (await db.execute(stmt)).one()
+    _set_rating_stats(service, row)
+    # Already inserted: attach as a loaded row so the commit doesn't INSERT it
+    rating.id = row.rating_id
+    rating.service_id = service.id
+    make_transient_to_detached(rating)
+    db.add(rating)
+
+
+def _rating_stats_update(service_id: int, score: int):
+    new_sum = func.coalesce(Service.rating_sum, 0) + score
+    new_count = func.coalesce(Service.rating_count, 0) + 1
+    return (
+        update(Service)
+        .where(Service.id == service_id)
+        .values(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            # "1.0" keeps the division (and round()) numeric on Postgres, real on SQLite
+            avg_rating=func.round(new_sum * literal_column("1.0") / new_count, 1),
+        )
+        .returning(Service.avg_rating, Service.rating_count, Service.rating_sum)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _set_rating_stats(service: Service, row) -> None:
+    # Already written; record as loaded state so the commit doesn't UPDATE again
+    set_committed_value(service, "avg_rating", row.avg_rating)
+    set_committed_value(service, "rating_count", row.rating_count)
+    set_committed_value(service, "rating_sum", row.rating_sum)
 
 
 _EMAIL_RE = re.compile(r"[a-zA-Z0-9._%+\-]+@[a-zA-Z0-9.\-]+\.[a-zA-Z]{2,}")
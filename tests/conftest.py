@@ -2,14 +2,17 @@ import os
 
 import pytest
 import pytest_asyncio
-from httpx import ASGITransport, AsyncClient
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from httpx import ASGITransport, AsyncClient, Client
+from sqlalchemy import event, insert, make_url, select
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.pool import NullPool
 
 from app.config import settings
 from app.database import Base, get_db
 from app.models import Category, Service, Rating
 from app.main import app, limiter, SEED_CATEGORIES
+from app.utils import bump_services_version
+from tests.live_server import find_free_port, spawn_uvicorn, stop_uvicorn
 
 # Bypass L402 paywall in tests
 settings.AUTH_ROOT_KEY = "test-mode"
@@ -20,47 +23,140 @@ _TEST_DB_URL = os.getenv(
 )
 
 
+def _worker_db_url(url: str) -> str:
+    """Give each pytest-xdist worker its own database, e.g. satring_test_gw0.
+
+    In-memory SQLite is already private to the worker process.
+    """
+    worker = os.environ.get("PYTEST_XDIST_WORKER")
+    parsed = make_url(url)
+    if not worker or parsed.database in (None, "", ":memory:"):
+        return url
+    root, ext = os.path.splitext(parsed.database)
+    return parsed.set(database=f"{root}_{worker}{ext}").render_as_string(hide_password=False)
+
+
+_TEST_DB_URL = _worker_db_url(_TEST_DB_URL)
+
+
+# Stateless (no lifespan, no loop binding), so every client can share it
+_transport = ASGITransport(app=app)
+
+
 @pytest.fixture(scope="session")
 def anyio_backend():
     return "asyncio"
 
 
-async def _make_db():
-    """Create a fresh DB engine + seeded session."""
-    engine = create_async_engine(_TEST_DB_URL, echo=False)
-    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+@pytest.fixture(scope="session")
+def live_server():
+    """Dedicated test-mode uvicorn on a free port, shared by the whole run. Yields its base URL."""
+    port = find_free_port()
+    try:
+        proc = spawn_uvicorn(port)
+    except RuntimeError as e:
+        pytest.fail(str(e))
+
+    yield f"http://127.0.0.1:{port}"
+    stop_uvicorn(proc)
 
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
 
-    session = session_factory()
-    for name, slug, description in SEED_CATEGORIES:
-        session.add(Category(name=name, slug=slug, description=description))
-    await session.commit()
-    return engine, session
+@pytest.fixture(scope="session")
+def live_client(request):
+    """Keep-alive client bound to live_server, so smoke tests reuse one connection.
+
+    SMOKE_INPROCESS=1 drives the app in-process instead (no uvicorn, no port);
+    the lifespan still runs init_db and seeding against DATABASE_URL.
+    """
+    if os.getenv("SMOKE_INPROCESS") == "1":
+        from starlette.testclient import TestClient
+        with TestClient(app) as client:
+            yield client
+        return
+    with Client(base_url=request.getfixturevalue("live_server"), timeout=10) as client:
+        yield client
+
+
+_engine = None
+
+
+def _configure_sqlite(engine):
+    """Throwaway-DB pragmas, and let pysqlite emit SAVEPOINT inside our outer
+    transaction (SQLAlchemy aiosqlite docs)."""
+    @event.listens_for(engine.sync_engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        # No durability needed: the test DB is discarded at exit
+        for pragma in ("synchronous=OFF", "journal_mode=MEMORY", "temp_store=MEMORY"):
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+
+async def _get_engine():
+    """Test engine shared by every test: schema created and categories seeded once."""
+    global _engine
+    if _engine is None:
+        url = make_url(_TEST_DB_URL)
+        if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+            # Default StaticPool keeps the one in-memory DB alive across tests
+            engine = create_async_engine(url, echo=False)
+        else:
+            # Each test runs in its own event loop; asyncpg connections can't be reused across loops
+            engine = create_async_engine(url, echo=False, poolclass=NullPool)
+        if url.get_backend_name() == "sqlite":
+            _configure_sqlite(engine)
+
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(insert(Category), [
+                {"name": name, "slug": slug, "description": description}
+                for name, slug, description in SEED_CATEGORIES
+            ])
+        _engine = engine
+    return _engine
+
+
+async def _make_db():
+    """Open a session inside a transaction that teardown rolls back.
+
+    Commits made by tests and app code only release a SAVEPOINT, so every
+    test starts from the freshly seeded schema.
+    """
+    engine = await _get_engine()
+    conn = await engine.connect()
+    await conn.begin()
+    session = AsyncSession(bind=conn, expire_on_commit=False, join_transaction_mode="create_savepoint")
+    return conn, session
 
 
-async def _teardown_db(engine, session):
+async def _teardown_db(conn, session):
     await session.close()
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-    await engine.dispose()
+    await conn.rollback()
+    await conn.close()
+    # The rollback rewrites services behind the ORM events; don't let the next
+    # test reuse listing ETags or counts cached against this one's rows
+    bump_services_version()
 
 
 @pytest_asyncio.fixture
 async def db():
-    engine, session = await _make_db()
+    conn, session = await _make_db()
     yield session
-    await _teardown_db(engine, session)
+    await _teardown_db(conn, session)
 
 
 @pytest_asyncio.fixture(scope="class", loop_scope="class")
 async def class_db():
     """Class-scoped DB: all tests in a class share one database."""
-    engine, session = await _make_db()
+    conn, session = await _make_db()
     yield session
-    await _teardown_db(engine, session)
+    await _teardown_db(conn, session)
 
 
 @pytest_asyncio.fixture
@@ -70,8 +166,7 @@ async def client(db: AsyncSession):
 
     app.dependency_overrides[get_db] = override_get_db
     limiter.reset()
-    transport = ASGITransport(app=app)
-    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+    async with AsyncClient(transport=_transport, base_url="http://test") as ac:
         yield ac
     app.dependency_overrides.clear()
 
@@ -84,8 +179,7 @@ async def class_client(class_db: AsyncSession):
 
     app.dependency_overrides[get_db] = override_get_db
     limiter.reset()
-    transport = ASGITransport(app=app)
-    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+    async with AsyncClient(transport=_transport, base_url="http://test") as ac:
         yield ac
     app.dependency_overrides.clear()
 
@@ -165,20 +259,19 @@ async def sample_mpp_service(db: AsyncSession) -> Service:
 
 @pytest_asyncio.fixture
 async def sample_service_with_ratings(db: AsyncSession, sample_service: Service) -> Service:
-    for score, comment, name in [
-        (5, "Excellent", "Alice"),
-        (4, "Pretty good", "Bob"),
-        (3, "Average", "Charlie"),
-    ]:
-        db.add(Rating(
-            service_id=sample_service.id, score=score,
-            comment=comment, reviewer_name=name,
-        ))
-    await db.flush()
+    await db.execute(insert(Rating), [
+        {"service_id": sample_service.id, "score": score, "comment": comment, "reviewer_name": name}
+        for score, comment, name in [
+            (5, "Excellent", "Alice"),
+            (4, "Pretty good", "Bob"),
+            (3, "Average", "Charlie"),
+        ]
+    ])
 
     # Update denormalized fields
     sample_service.avg_rating = 4.0
     sample_service.rating_count = 3
+    sample_service.rating_sum = 12
     await db.commit()
     await db.refresh(sample_service)
     return sample_service
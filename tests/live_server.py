@@ -0,0 +1,61 @@
+"""Helpers for running the app under a real uvicorn process (see test_endpt_smoke.py).
+
+Kept free of app imports so the standalone smoke runner stays light.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+
+def port_open(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.settimeout(0.05)  # localhost either accepts or refuses at once
+        return s.connect_ex(("127.0.0.1", port)) == 0
+
+
+def wait_for_port(port: int, timeout: float = 9.0) -> bool:
+    """Poll until something listens on port, backing off from 10ms to 200ms."""
+    deadline = time.monotonic() + timeout
+    delay = 0.01
+    while time.monotonic() < deadline:
+        if port_open(port):
+            return True
+        time.sleep(delay)
+        delay = min(delay * 1.5, 0.2)
+    return False
+
+
+def find_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("", 0))
+        return s.getsockname()[1]
+
+
+def spawn_uvicorn(port: int) -> subprocess.Popen:
+    """Start a test-mode uvicorn on port and wait until it accepts connections."""
+    env = {**os.environ, "AUTH_ROOT_KEY": "test-mode"}
+    proc = subprocess.Popen(
+        # --loop/--http default to "auto", which already picks uvloop and httptools
+        # from uvicorn[standard]; output goes to DEVNULL, so skip access logging
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--no-access-log"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=env,
+    )
+    if not wait_for_port(port):
+        proc.kill()
+        raise RuntimeError(f"uvicorn failed to start on :{port}")
+    return proc
+
+
+def stop_uvicorn(proc: subprocess.Popen) -> None:
+    """SIGTERM the server, hard-killing it if graceful shutdown stalls on open connections."""
+    proc.terminate()
+    try:
+        proc.wait(timeout=2)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait(timeout=1)
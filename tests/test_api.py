@@ -148,6 +148,36 @@ class TestGetService:
         assert data["protocol"] == "L402"
         assert data["pricing_sats"] == 100
 
+    @pytest.mark.asyncio
+    async def test_null_columns_served_as_defaults(self, client: AsyncClient, db: AsyncSession):
+        """Responses are built without validation; NULL columns still serialize as the schema's types."""
+        svc = Service(
+            name="Null API", slug="null-api", url="https://null.test.com",
+            description=None, pricing_model=None, protocol=None,
+            owner_name=None, logo_url=None, hit_count_30d=None,
+        )
+        db.add(svc)
+        await db.flush()
+        db.add(Rating(service_id=svc.id, score=4, comment=None, reviewer_name=None))
+        await db.commit()
+
+        resp = await client.get("/api/v1/services/null-api")
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["description"] == ""
+        assert data["pricing_model"] == "per-request"
+        assert data["protocol"] == "L402"
+        assert data["owner_name"] == ""
+        assert data["logo_url"] == ""
+        assert data["hit_count_30d"] == 0
+        assert data["x402_network"] is None  # Optional fields stay null
+
+        resp = await client.get("/api/v1/services/null-api/ratings")
+        assert resp.status_code == 200
+        rating = resp.json()[0]
+        assert rating["comment"] == ""
+        assert rating["reviewer_name"] == "Anonymous"
+
     @pytest.mark.asyncio
     async def test_get_nonexistent(self, client: AsyncClient):
         resp = await client.get("/api/v1/services/nope")
@@ -195,6 +225,20 @@ class TestCreateService:
         assert data["pricing_usd"] == "0.50"
         assert len(data["categories"]) == 2
 
+    @pytest.mark.asyncio
+    async def test_create_with_long_hostname(self, client: AsyncClient, db: AsyncSession):
+        """A host past 255 chars fits Service.domain, which is as wide as url."""
+        host = ".".join(["a" * 60] * 5) + ".example.com"
+        assert len(host) > 255
+        resp = await client.post("/api/v1/services", json={
+            "name": "Long Host API",
+            "url": f"https://{host}/v1",
+        })
+        assert resp.status_code == 201
+        svc = (await db.execute(select(Service).where(Service.slug == resp.json()["slug"]))).scalar_one()
+        assert svc.domain == host
+        assert Service.__table__.c.domain.type.length >= Service.__table__.c.url.type.length
+
     @pytest.mark.asyncio
     async def test_create_dual_protocol(self, client: AsyncClient):
         resp = await client.post("/api/v1/services", json={
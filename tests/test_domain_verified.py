@@ -1,5 +1,8 @@
 """Tests for the domain_verified badge feature."""
 
+from contextlib import contextmanager
+
+import httpx
 import pytest
 from unittest.mock import patch, AsyncMock, MagicMock
 
@@ -7,8 +10,12 @@ from httpx import AsyncClient
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app import utils
 from app.models import Service
-from app.utils import generate_edit_token, hash_token, overwrite_purged_service
+from app.utils import (
+    VERIFY_MAX_BYTES, close_verify_client, fetch_verify_challenge,
+    generate_edit_token, hash_token, overwrite_purged_service,
+)
 
 
 async def _create_service(db: AsyncSession, slug: str, url: str = "https://ep.example.com") -> tuple[Service, str]:
@@ -20,11 +27,82 @@ async def _create_service(db: AsyncSession, slug: str, url: str = "https://ep.ex
         edit_token_hash=hash_token(token),
     )
     db.add(svc)
-    await db.commit()
-    await db.refresh(svc)
+    await db.commit()  # expire_on_commit=False: id and column defaults are already loaded
     return svc, token
 
 
+@contextmanager
+def _serve_challenge(routes: str, challenge: str):
+    """Patch app.routes.<routes> so the domain serves challenge, bypassing the SSRF check."""
+    with patch(f"app.routes.{routes}.fetch_verify_challenge", AsyncMock(return_value=challenge)), \
+         patch(f"app.routes.{routes}.is_public_hostname", return_value=True):
+        yield
+
+
+@pytest.fixture
+def verify_transport(monkeypatch):
+    """Route the shared verify client through a MockTransport; yields {"chunks_read", "client_kwargs"}.
+
+    The served body is a padded challenge streamed in 1KB chunks, far past VERIFY_MAX_BYTES.
+    """
+    seen = {"chunks_read": 0, "client_kwargs": None}
+
+    async def body():
+        yield b"\n  " + b"a" * 1021
+        for _ in range(63):
+            seen["chunks_read"] += 1
+            yield b"b" * 1024
+
+    real_client = httpx.AsyncClient
+
+    def make_client(**kwargs):
+        seen["client_kwargs"] = kwargs
+        return real_client(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=body())), **kwargs)
+
+    monkeypatch.setattr(utils, "_verify_client", None)
+    monkeypatch.setattr(utils.httpx, "AsyncClient", make_client)
+    yield seen
+
+
+class TestFetchVerifyChallenge:
+    @pytest.mark.asyncio
+    async def test_reads_at_most_max_bytes_and_strips(self, verify_transport):
+        try:
+            text = await fetch_verify_challenge("https://ep.example.com/.well-known/satring-verify")
+        finally:
+            await close_verify_client()
+        expected = (b"\n  " + b"a" * 1021 + b"b" * (VERIFY_MAX_BYTES - 1024)).decode().strip()
+        assert text == expected
+        # Stopped streaming at the cap rather than downloading the whole body
+        assert verify_transport["chunks_read"] < 63
+
+    @pytest.mark.asyncio
+    async def test_shared_client_is_bounded(self, verify_transport):
+        try:
+            await fetch_verify_challenge("https://ep.example.com/.well-known/satring-verify")
+            client = utils._verify_client
+            await fetch_verify_challenge("https://ep.example.com/.well-known/satring-verify")
+            assert utils._verify_client is client
+        finally:
+            await close_verify_client()
+        kwargs = verify_transport["client_kwargs"]
+        assert kwargs["follow_redirects"] is False
+        assert kwargs["limits"].max_connections == 20
+        assert kwargs["limits"].max_keepalive_connections == 10
+        assert kwargs["timeout"].connect == 5.0
+
+    @pytest.mark.asyncio
+    async def test_close_resets_module_client(self, verify_transport):
+        await fetch_verify_challenge("https://ep.example.com/.well-known/satring-verify")
+        client = utils._verify_client
+        assert client is not None
+
+        await close_verify_client()
+        assert utils._verify_client is None
+        assert client.is_closed
+        await close_verify_client()  # no-op once closed
+
+
 class TestDomainVerifiedDefault:
     @pytest.mark.asyncio
     async def test_new_service_not_verified(self, client: AsyncClient, db: AsyncSession):
@@ -59,15 +137,7 @@ class TestAPIVerifySetsFlag:
         challenge = gen_resp.json()["challenge"]
 
         # Mock HTTP fetch to return correct challenge + bypass SSRF check
-        with patch("app.routes.api.httpx.AsyncClient") as MockClient, \
-             patch("app.routes.api.is_public_hostname", return_value=True):
-            mock_resp = AsyncMock()
-            mock_resp.text = challenge
-            mock_instance = AsyncMock()
-            mock_instance.get.return_value = mock_resp
-            MockClient.return_value.__aenter__ = AsyncMock(return_value=mock_instance)
-            MockClient.return_value.__aexit__ = AsyncMock(return_value=False)
-
+        with _serve_challenge("api", challenge):
             resp = await client.post(f"/api/v1/services/{svc.slug}/recover/verify")
             assert resp.status_code == 200
 
@@ -83,15 +153,7 @@ class TestAPIVerifySetsFlag:
         gen_resp = await client.post(f"/api/v1/services/{svc1.slug}/recover/generate")
         challenge = gen_resp.json()["challenge"]
 
-        with patch("app.routes.api.httpx.AsyncClient") as MockClient, \
-             patch("app.routes.api.is_public_hostname", return_value=True):
-            mock_resp = AsyncMock()
-            mock_resp.text = challenge
-            mock_instance = AsyncMock()
-            mock_instance.get.return_value = mock_resp
-            MockClient.return_value.__aenter__ = AsyncMock(return_value=mock_instance)
-            MockClient.return_value.__aexit__ = AsyncMock(return_value=False)
-
+        with _serve_challenge("api", challenge):
             await client.post(f"/api/v1/services/{svc1.slug}/recover/verify")
 
         await db.refresh(svc1)
@@ -111,15 +173,7 @@ class TestWebVerifySetsFlag:
         challenge = svc.domain_challenge
 
         # Verify via web — bypass SSRF check since hostname won't resolve in tests
-        with patch("app.routes.web.httpx.AsyncClient") as MockClient, \
-             patch("app.routes.web.is_public_hostname", return_value=True):
-            mock_resp = AsyncMock()
-            mock_resp.text = challenge
-            mock_instance = AsyncMock()
-            mock_instance.get.return_value = mock_resp
-            MockClient.return_value.__aenter__ = AsyncMock(return_value=mock_instance)
-            MockClient.return_value.__aexit__ = AsyncMock(return_value=False)
-
+        with _serve_challenge("web", challenge):
             resp = await client.post(f"/services/{svc.slug}/recover", data={"action": "verify"})
             assert resp.status_code == 200
 
@@ -135,15 +189,7 @@ class TestWebVerifySetsFlag:
         await db.refresh(svc1)
         challenge = svc1.domain_challenge
 
-        with patch("app.routes.web.httpx.AsyncClient") as MockClient, \
-             patch("app.routes.web.is_public_hostname", return_value=True):
-            mock_resp = AsyncMock()
-            mock_resp.text = challenge
-            mock_instance = AsyncMock()
-            mock_instance.get.return_value = mock_resp
-            MockClient.return_value.__aenter__ = AsyncMock(return_value=mock_instance)
-            MockClient.return_value.__aexit__ = AsyncMock(return_value=False)
-
+        with _serve_challenge("web", challenge):
             await client.post(f"/services/{svc1.slug}/recover", data={"action": "verify"})
 
         await db.refresh(svc1)
@@ -311,15 +357,7 @@ class TestChallengePersistence:
         gen_resp = await client.post(f"/api/v1/services/{svc.slug}/recover/generate")
         challenge = gen_resp.json()["challenge"]
 
-        with patch("app.routes.api.httpx.AsyncClient") as MockClient, \
-             patch("app.routes.api.is_public_hostname", return_value=True):
-            mock_resp = AsyncMock()
-            mock_resp.text = challenge
-            mock_instance = AsyncMock()
-            mock_instance.get.return_value = mock_resp
-            MockClient.return_value.__aenter__ = AsyncMock(return_value=mock_instance)
-            MockClient.return_value.__aexit__ = AsyncMock(return_value=False)
-
+        with _serve_challenge("api", challenge):
             await client.post(f"/api/v1/services/{svc.slug}/recover/verify")
 
         await db.refresh(svc)
@@ -334,15 +372,7 @@ class TestChallengePersistence:
         await db.refresh(svc)
         challenge = svc.domain_challenge
 
-        with patch("app.routes.web.httpx.AsyncClient") as MockClient, \
-             patch("app.routes.web.is_public_hostname", return_value=True):
-            mock_resp = AsyncMock()
-            mock_resp.text = challenge
-            mock_instance = AsyncMock()
-            mock_instance.get.return_value = mock_resp
-            MockClient.return_value.__aenter__ = AsyncMock(return_value=mock_instance)
-            MockClient.return_value.__aexit__ = AsyncMock(return_value=False)
-
+        with _serve_challenge("web", challenge):
             await client.post(f"/services/{svc.slug}/recover", data={"action": "verify"})
 
         await db.refresh(svc)
@@ -357,15 +387,7 @@ class TestChallengePersistence:
         gen_resp = await client.post(f"/api/v1/services/{svc1.slug}/recover/generate")
         challenge = gen_resp.json()["challenge"]
 
-        with patch("app.routes.api.httpx.AsyncClient") as MockClient, \
-             patch("app.routes.api.is_public_hostname", return_value=True):
-            mock_resp = AsyncMock()
-            mock_resp.text = challenge
-            mock_instance = AsyncMock()
-            mock_instance.get.return_value = mock_resp
-            MockClient.return_value.__aenter__ = AsyncMock(return_value=mock_instance)
-            MockClient.return_value.__aexit__ = AsyncMock(return_value=False)
-
+        with _serve_challenge("api", challenge):
             await client.post(f"/api/v1/services/{svc1.slug}/recover/verify")
 
         await db.refresh(svc1)
@@ -1,12 +1,14 @@
 """Tests for edit token utilities, web edit flow, API PATCH flow, and delete flow."""
 
+import re
+
 import pytest
 from httpx import AsyncClient
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import Service, Rating
-from app.utils import generate_edit_token, hash_token, verify_edit_token
+from app.utils import generate_edit_token, hash_token, verify_edit_token, verify_edit_token_any
 
 
 # ---------------------------------------------------------------------------
@@ -27,9 +29,7 @@ class TestTokenUtils:
         assert hash_token(token) == hash_token(token)
 
     def test_hash_token_is_hex_sha256(self):
-        h = hash_token("hello")
-        assert len(h) == 64
-        assert all(c in "0123456789abcdef" for c in h)
+        assert re.fullmatch(r"[0-9a-f]{64}", hash_token("hello"))
 
     def test_verify_edit_token_correct(self):
         token = generate_edit_token()
@@ -41,14 +41,27 @@ class TestTokenUtils:
         h = hash_token(token)
         assert verify_edit_token("wrong-token", h) is False
 
+    def test_verify_edit_token_any(self):
+        token = generate_edit_token()
+        hashes = [None, hash_token("other"), hash_token(token)]
+        assert verify_edit_token_any(token, hashes) is True
+        assert verify_edit_token_any("wrong-token", hashes) is False
+        assert verify_edit_token_any(token, []) is False
+
 
 # ---------------------------------------------------------------------------
 # Helper: create a service with an edit token
 # ---------------------------------------------------------------------------
 
+# One token for the whole module: each test's DB is rolled back, so services
+# never see another test's token, and the hash is computed once
+_EDIT_TOKEN = generate_edit_token()
+_EDIT_TOKEN_HASH = hash_token(_EDIT_TOKEN)
+
+
 async def create_service_with_token(db: AsyncSession) -> tuple[Service, str]:
     """Create a test service and return (service, plaintext_token)."""
-    token = generate_edit_token()
+    token = _EDIT_TOKEN
     svc = Service(
         name="Editable API",
         slug="editable-api",
@@ -59,11 +72,10 @@ async def create_service_with_token(db: AsyncSession) -> tuple[Service, str]:
         protocol="L402",
         owner_name="Owner",
         owner_contact="owner@example.com",
-        edit_token_hash=hash_token(token),
+        edit_token_hash=_EDIT_TOKEN_HASH,
     )
     db.add(svc)
-    await db.commit()
-    await db.refresh(svc)
+    await db.commit()  # expire_on_commit=False: id and column defaults are already loaded
     return svc, token
 
 
@@ -281,10 +293,13 @@ class TestWebSubmitReturnsToken:
 # services, later tests delete them)
 # ---------------------------------------------------------------------------
 
-import re
 from sqlalchemy import func
 
+# submit_success.html renders the plaintext token in <code id="edit-token">
+_EDIT_TOKEN_RE = re.compile(r'id="edit-token"[^>]*>([^<]+)<')
 
+
+@pytest.mark.xdist_group("delete_lifecycle")  # ordered steps on one class_db: keep on one worker
 class TestDeleteLifecycle:
     """Shares one DB across all methods so services accumulate then get deleted."""
 
@@ -294,7 +309,7 @@ class TestDeleteLifecycle:
     async def test_1_web_submit_creates_service(self, class_client: AsyncClient, class_db: AsyncSession):
         resp = await class_client.post("/submit", content="name=Web+Created&url=https%3A%2F%2Fweb-created.example.com&description=From+web+form&categories=9", headers={"Content-Type": "application/x-www-form-urlencoded"}, follow_redirects=False)
         assert resp.status_code == 200
-        match = re.search(r'id="edit-token"[^>]*>([^<]+)<', resp.text)
+        match = _EDIT_TOKEN_RE.search(resp.text)
         assert match
         # stash on the class so later tests can use it
         TestDeleteLifecycle.web_token = match.group(1).strip()
@@ -327,9 +342,9 @@ class TestDeleteLifecycle:
             })
             assert resp.status_code == 201
 
-        count = (await class_db.execute(
+        count = await class_db.scalar(
             select(func.count(Rating.id)).where(Rating.service_id == TestDeleteLifecycle.api_service_id)
-        )).scalar()
+        )
         assert count == 3
 
     # -- auth checks (services survive) -----------------------------------
@@ -399,5 +414,5 @@ class TestDeleteLifecycle:
     @pytest.mark.asyncio(loop_scope="class")
     async def test_8_no_test_services_remain(self, class_client: AsyncClient, class_db: AsyncSession):
         """After deletes, zero services should be left in the DB."""
-        count = (await class_db.execute(select(func.count(Service.id)))).scalar()
+        count = await class_db.scalar(select(func.count(Service.id)))
         assert count == 0
@@ -2,23 +2,27 @@
 """Smoke tests against a live uvicorn server.
 
 Run with pytest:
-    pytest tests/test_endpt_smoke.py -v -s
+    pytest tests/test_endpt_smoke.py -v -s        # status + size per endpoint
+    pytest tests/test_endpt_smoke.py -vv -s       # also print response bodies
 
 Run standalone (same behavior, selective endpoints):
     python tests/test_endpt_smoke.py                  # Hit all endpoints
     python tests/test_endpt_smoke.py list detail      # Hit specific ones
     python tests/test_endpt_smoke.py --help           # Show available endpoint names
 
-Starts uvicorn automatically if not already running.
+Starts uvicorn automatically if not already running. Under pytest,
+SMOKE_INPROCESS=1 skips uvicorn and drives the app in-process.
 Uses APP_PORT from config (default 8000).
+Under pytest, per-request output (the "smoke" logger) is shown only with -s:
+status and size per request, plus bodies with -vv or SMOKE_VERBOSE=1.
 Auto-detects test-mode vs production: paywalled endpoints expect 200 in
 test-mode and 402 in production.
 """
 
+import inspect
 import json
+import logging
 import os
-import subprocess
-import socket
 import sys
 import time
 
@@ -30,175 +34,208 @@ os.environ["AUTH_ROOT_KEY"] = "test-mode"
 import httpx
 
 from app.config import settings
+from tests.live_server import port_open, spawn_uvicorn, stop_uvicorn
 
 PORT = settings.APP_PORT
 TIMEOUT = 10
 
-# State shared across ordered tests (populated by create)
-_state = {"slug": None, "edit_token": None, "base": None}
+# Pretty-print response bodies; the standalone runner and -vv turn this on
+_verbose = os.getenv("SMOKE_VERBOSE") == "1"
 
+# Per-request output; INFO only with pytest -s or standalone, else nothing is formatted
+log = logging.getLogger("smoke")
+log.propagate = False
+SEP = "=" * 60
 
-def _base_url():
-    return _state["base"] or f"http://localhost:{PORT}"
 
-
-def _is_test_mode(base: str) -> bool:
+def _is_test_mode(client: httpx.Client) -> bool:
     """Detect whether the live server is running in test-mode by probing a paywalled endpoint."""
     try:
-        r = httpx.get(f"{base}/api/v1/services/bulk", timeout=TIMEOUT)
-        return r.status_code != 402
+        # Only the status matters; don't download the export
+        with client.stream("GET", "/api/v1/services/bulk") as r:
+            return r.status_code != 402
     except Exception:
         return True  # assume test-mode if server unreachable (fixture will start one)
 
 
 # ---------------------------------------------------------------------------
-# Fixture: start uvicorn for the module, stop when done
+# Fixtures: live_server/live_client (conftest) share one uvicorn and client per run
 # ---------------------------------------------------------------------------
 
-def _port_open(port: int) -> bool:
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        return s.connect_ex(("localhost", port)) == 0
+@pytest.fixture(scope="module")
+def test_mode(live_client):
+    """True when the live server is in test-mode (L402 bypassed)."""
+    return _is_test_mode(live_client)
 
 
-def _find_free_port() -> int:
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind(("", 0))
-        return s.getsockname()[1]
+def _create_service(client: httpx.Client, host: str = "smoke") -> httpx.Response:
+    """POST a throwaway service; give each caller its own host to avoid the duplicate-URL 409."""
+    _header("Create Service", "POST", "/api/v1/services")
+    stamp = int(time.time())
+    r = client.post("/api/v1/services", json={
+        "name": f"Smoke Test {stamp}",
+        "url": f"https://{host}-{stamp}.example.com",
+        "description": "Created by smoke test",
+        "pricing_sats": 42,
+    })
+    _show_result(r)
+    return r
 
 
-@pytest.fixture(scope="module")
-def live_server():
-    """Always start a dedicated test-mode uvicorn on a free port."""
-    port = _find_free_port()
-    _state["base"] = f"http://localhost:{port}"
-
-    env = {**os.environ, "AUTH_ROOT_KEY": "test-mode"}
-    proc = subprocess.Popen(
-        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-        env=env,
-    )
-    for _ in range(30):
-        time.sleep(0.3)
-        if _port_open(port):
-            break
-    else:
-        proc.kill()
-        pytest.fail("uvicorn failed to start within 9 seconds")
+def _smoke_service(client: httpx.Client, test_mode: bool):
+    """Create one service, yield it, then delete it.
 
-    yield proc
-    proc.terminate()
-    proc.wait(timeout=5)
+    In production creating costs a payment, so this yields the first listed
+    service instead, without an edit_token.
+    """
+    if not test_mode:
+        services = client.get("/api/v1/services?page_size=1").json().get("services", [])
+        if not services:
+            raise LookupError("no services listed")
+        yield services[0]
+        return
+    r = _create_service(client)
+    assert r.status_code == 201
+    svc = r.json()
+    yield svc
+    client.delete(f"/api/v1/services/{svc['slug']}", headers={"X-Edit-Token": svc["edit_token"]})
 
 
 @pytest.fixture(scope="module")
-def test_mode(live_server):
-    """True when the live server is in test-mode (L402 bypassed)."""
-    return _is_test_mode(_base_url())
+def smoke_service(live_client, test_mode):
+    """The service slug-based tests run against, created once per module (per xdist worker)."""
+    service_gen = _smoke_service(live_client, test_mode)
+    try:
+        service = next(service_gen)
+    except LookupError as e:
+        pytest.skip(str(e))
+    yield service
+    next(service_gen, None)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def _verbosity(request):
+    global _verbose
+    _verbose = _verbose or request.config.getoption("verbose") >= 2
+    _configure_log(logging.INFO if request.config.getoption("capture") == "no" else logging.WARNING)
 
 
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
 
-def _pp(data):
-    print(json.dumps(data, indent=2, default=str))
+def _configure_log(level):
+    # Bound to sys.stdout when configured, not at import, so pytest's capture is respected
+    if not log.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(handler)
+    log.setLevel(level)
 
 
 def _header(name, method, path):
-    print(f"\n{'='*60}")
-    print(f"  {name}")
-    print(f"  {method} {path}")
-    print(f"{'='*60}")
+    log.info("\n%s\n  %s\n  %s %s\n%s", SEP, name, method, path, SEP)
+
+
+def _show_status(status_code, nbytes):
+    status_color = "\033[32m" if status_code < 400 else "\033[31m"
+    log.info("  status: %s%s\033[0m (%d bytes)", status_color, status_code, nbytes)
 
 
 def _show_result(resp):
-    status_color = "\033[32m" if resp.status_code < 400 else "\033[31m"
-    print(f"  status: {status_color}{resp.status_code}\033[0m")
+    """Log status and size; with verbose output also the body."""
+    if not log.isEnabledFor(logging.INFO):
+        return
+    _show_status(resp.status_code, len(resp.content))
+    if not _verbose:
+        return
     ct = resp.headers.get("content-type", "")
     if "json" in ct:
-        _pp(resp.json())
+        log.info("%s", json.dumps(resp.json(), indent=2, default=str))
     else:
-        print(resp.text[:500])
+        log.info("%s", resp.text[:500])
+
+
+def _show_streamed(resp):
+    """Drain a streamed response in 64KB chunks without buffering it.
+
+    Verbose output shows only the first 500 bytes of the body.
+    """
+    nbytes = 0
+    head = b""
+    for chunk in resp.iter_bytes(65536):
+        if len(head) < 500:
+            head += chunk[:500 - len(head)]
+        nbytes += len(chunk)
+    _show_status(resp.status_code, nbytes)
+    if _verbose:
+        log.info("%s", head.decode(errors="replace"))
 
 
 # ---------------------------------------------------------------------------
-# Tests (ordered: create before patch/detail so slug+token are available)
+# Tests
 # ---------------------------------------------------------------------------
 
-def test_list(live_server):
+def test_list(live_client):
     _header("List Services", "GET", "/api/v1/services")
-    r = httpx.get(f"{_base_url()}/api/v1/services?page_size=3", timeout=TIMEOUT)
+    r = live_client.get("/api/v1/services?page_size=3")
     _show_result(r)
     assert r.status_code == 200
-    services = r.json().get("services", [])
-    if services:
-        _state["slug"] = services[0]["slug"]
 
 
-def test_search(live_server):
+def test_search(live_client):
     _header("Search", "GET", "/api/v1/search?q=satring")
-    r = httpx.get(f"{_base_url()}/api/v1/search?q=satring", timeout=TIMEOUT)
+    r = live_client.get("/api/v1/search?q=satring")
     _show_result(r)
     assert r.status_code == 200
 
 
-def test_create(live_server, test_mode):
-    _header("Create Service", "POST", "/api/v1/services")
-    r = httpx.post(f"{_base_url()}/api/v1/services", json={
-        "name": f"Smoke Test {int(time.time())}",
-        "url": f"https://smoke-{int(time.time())}.example.com",
-        "description": "Created by smoke test",
-        "pricing_sats": 42,
-    }, timeout=TIMEOUT)
-    _show_result(r)
+def test_create(live_client, test_mode, smoke_service):
+    # In test-mode the smoke_service fixture already did the POST
     if test_mode:
-        assert r.status_code == 201
-        data = r.json()
-        _state["slug"] = data["slug"]
-        _state["edit_token"] = data.get("edit_token")
+        assert smoke_service["slug"]
+        assert smoke_service["edit_token"]
     else:
-        assert r.status_code == 402
+        assert _create_service(live_client).status_code == 402
 
 
-def test_detail(live_server):
-    slug = _state["slug"]
+def test_detail(live_client, smoke_service):
+    slug = smoke_service["slug"]
     _header("Service Detail", "GET", f"/api/v1/services/{slug}")
-    r = httpx.get(f"{_base_url()}/api/v1/services/{slug}", timeout=TIMEOUT)
+    r = live_client.get(f"/api/v1/services/{slug}")
     _show_result(r)
     assert r.status_code == 200
 
 
-def test_patch(live_server):
-    slug = _state.get("slug")
-    token = _state.get("edit_token")
-    if not slug or not token:
-        pytest.skip("no service created yet")
+def test_patch(live_client, test_mode, smoke_service):
+    if not test_mode:
+        pytest.skip("editing needs the token from a test-mode create")
+    slug = smoke_service["slug"]
+    token = smoke_service["edit_token"]
     _header("Patch Service", "PATCH", f"/api/v1/services/{slug}")
-    r = httpx.patch(f"{_base_url()}/api/v1/services/{slug}", json={
+    r = live_client.patch(f"/api/v1/services/{slug}", json={
         "description": "Updated by smoke test",
-    }, headers={"X-Edit-Token": token}, timeout=TIMEOUT)
+    }, headers={"X-Edit-Token": token})
     _show_result(r)
     assert r.status_code == 200
 
 
-def test_ratings(live_server):
-    slug = _state["slug"]
+def test_ratings(live_client, smoke_service):
+    slug = smoke_service["slug"]
     _header("List Ratings", "GET", f"/api/v1/services/{slug}/ratings")
-    r = httpx.get(f"{_base_url()}/api/v1/services/{slug}/ratings", timeout=TIMEOUT)
+    r = live_client.get(f"/api/v1/services/{slug}/ratings")
     _show_result(r)
     assert r.status_code == 200
 
 
-def test_rate(live_server, test_mode):
-    slug = _state["slug"]
+def test_rate(live_client, test_mode, smoke_service):
+    slug = smoke_service["slug"]
     _header("Create Rating", "POST", f"/api/v1/services/{slug}/ratings")
-    r = httpx.post(f"{_base_url()}/api/v1/services/{slug}/ratings", json={
+    r = live_client.post(f"/api/v1/services/{slug}/ratings", json={
         "score": 5,
         "comment": "Smoke test review",
         "reviewer_name": "SmokeBot",
-    }, timeout=TIMEOUT)
+    })
     _show_result(r)
     if test_mode:
         assert r.status_code == 201
@@ -206,9 +243,9 @@ def test_rate(live_server, test_mode):
         assert r.status_code == 402
 
 
-def test_analytics(live_server, test_mode):
+def test_analytics(live_client, test_mode):
     _header("Analytics", "GET", "/api/v1/analytics")
-    r = httpx.get(f"{_base_url()}/api/v1/analytics", timeout=TIMEOUT)
+    r = live_client.get("/api/v1/analytics")
     _show_result(r)
     if test_mode:
         assert r.status_code == 200
@@ -216,10 +253,10 @@ def test_analytics(live_server, test_mode):
         assert r.status_code == 402
 
 
-def test_reputation(live_server, test_mode):
-    slug = _state["slug"]
+def test_reputation(live_client, test_mode, smoke_service):
+    slug = smoke_service["slug"]
     _header("Reputation", "GET", f"/api/v1/services/{slug}/reputation")
-    r = httpx.get(f"{_base_url()}/api/v1/services/{slug}/reputation", timeout=TIMEOUT)
+    r = live_client.get(f"/api/v1/services/{slug}/reputation")
     _show_result(r)
     if test_mode:
         assert r.status_code == 200
@@ -227,38 +264,40 @@ def test_reputation(live_server, test_mode):
         assert r.status_code == 402
 
 
-def test_bulk(live_server, test_mode):
+def test_bulk(live_client, test_mode):
     _header("Bulk Export", "GET", "/api/v1/services/bulk")
-    r = httpx.get(f"{_base_url()}/api/v1/services/bulk", timeout=TIMEOUT)
-    _show_result(r)
+    with live_client.stream("GET", "/api/v1/services/bulk") as r:
+        _show_streamed(r)
     if test_mode:
         assert r.status_code == 200
     else:
         assert r.status_code == 402
 
 
-def test_recover_generate(live_server):
-    slug = _state["slug"]
+def test_recover_generate(live_client, smoke_service):
+    slug = smoke_service["slug"]
     _header("Recover Generate", "POST", f"/api/v1/services/{slug}/recover/generate")
-    r = httpx.post(f"{_base_url()}/api/v1/services/{slug}/recover/generate", timeout=TIMEOUT)
+    r = live_client.post(f"/api/v1/services/{slug}/recover/generate")
     _show_result(r)
     assert r.status_code == 200
 
 
-def test_delete(live_server):
-    slug = _state.get("slug")
-    token = _state.get("edit_token")
-    if not slug or not token:
-        pytest.skip("no service created yet")
+def test_delete(live_client, test_mode):
+    if not test_mode:
+        pytest.skip("deleting needs the token from a test-mode create")
+    # Delete a service of its own, leaving smoke_service to the other tests
+    created = _create_service(live_client, host="smoke-delete")
+    assert created.status_code == 201
+    slug = created.json()["slug"]
+    token = created.json()["edit_token"]
     _header("Delete Service", "DELETE", f"/api/v1/services/{slug}")
-    r = httpx.delete(f"{_base_url()}/api/v1/services/{slug}",
-                     headers={"X-Edit-Token": token}, timeout=TIMEOUT)
+    r = live_client.delete(f"/api/v1/services/{slug}", headers={"X-Edit-Token": token})
     _show_result(r)
     assert r.status_code == 200
     assert r.json() == {"deleted": slug}
 
     # Confirm it's gone
-    r2 = httpx.get(f"{_base_url()}/api/v1/services/{slug}", timeout=TIMEOUT)
+    r2 = live_client.get(f"/api/v1/services/{slug}")
     assert r2.status_code == 404
 
 
@@ -300,6 +339,7 @@ def show_help():
 
 
 def main():
+    global _verbose
     args = [a for a in sys.argv[1:] if not a.startswith("-")]
     flags = [a for a in sys.argv[1:] if a.startswith("-")]
 
@@ -307,65 +347,72 @@ def main():
         show_help()
         return
 
+    targets = args if args else ALL_ORDER
+    unknown = [t for t in targets if t not in ENDPOINTS]
+    if unknown:
+        print(f"Unknown endpoints: {', '.join(unknown)}")
+        print("Run with --help to see available endpoints")
+        sys.exit(1)
+
+    _verbose = True
+    _configure_log(logging.INFO)
     print("\n=== satring Smoke Test ===\n")
 
     # In standalone mode, reuse running server or start one on APP_PORT
-    if _port_open(PORT):
-        _state["base"] = f"http://localhost:{PORT}"
+    base = f"http://127.0.0.1:{PORT}"
+    if port_open(PORT):
         print(f"  server already running on :{PORT}\n")
         proc = None
     else:
         print("  starting uvicorn (test-mode)...")
-        _state["base"] = f"http://localhost:{PORT}"
-        env = {**os.environ, "AUTH_ROOT_KEY": "test-mode"}
-        proc = subprocess.Popen(
-            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(PORT)],
-            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env,
-        )
-        for _ in range(30):
-            time.sleep(0.3)
-            if _port_open(PORT):
-                break
-        else:
-            proc.kill()
+        try:
+            proc = spawn_uvicorn(PORT)
+        except RuntimeError:
             print("  ERROR: server failed to start")
             sys.exit(1)
         print("  server started\n")
 
-    is_test = _is_test_mode(_base_url())
-    print(f"  mode: {'test' if is_test else 'production'}\n")
-
-    targets = args if args else ALL_ORDER
-    unknown = [t for t in targets if t not in ENDPOINTS]
-    if unknown:
-        print(f"Unknown endpoints: {', '.join(unknown)}")
-        print("Run with --help to see available endpoints")
-        sys.exit(1)
-
-    passed = failed = 0
-    for name in targets:
-        try:
-            fn = ENDPOINTS[name][0]
-            # Pass test_mode to functions that need it
-            import inspect
-            params = inspect.signature(fn).parameters
-            if "test_mode" in params:
-                fn(None, is_test)
-            else:
-                fn(None)
-            passed += 1
-        except Exception as e:
-            print(f"  ERROR: {e}\n")
-            failed += 1
-
-    print(f"\n{'='*60}")
-    print(f"  Done: {passed} passed, {failed} failed")
-    print(f"{'='*60}")
-
-    if proc:
-        proc.terminate()
-        print("  server stopped")
-
+    client = httpx.Client(base_url=base, timeout=TIMEOUT)
+    # Stand-ins for the pytest fixtures; the service is created on first use
+    service_gen = None
+    service = None
+    try:
+        is_test = _is_test_mode(client)
+        print(f"  mode: {'test' if is_test else 'production'}\n")
+        service_gen = _smoke_service(client, is_test)
+
+        passed = failed = skipped = 0
+        for name in targets:
+            try:
+                fn = ENDPOINTS[name][0]
+                kwargs = {}
+                params = inspect.signature(fn).parameters
+                if "test_mode" in params:
+                    kwargs["test_mode"] = is_test
+                if "smoke_service" in params:
+                    if service is None:
+                        service = next(service_gen)
+                    kwargs["smoke_service"] = service
+                fn(client, **kwargs)
+                passed += 1
+            except pytest.skip.Exception as e:
+                print(f"  SKIPPED: {e}\n")
+                skipped += 1
+            except Exception as e:
+                print(f"  ERROR: {e}\n")
+                failed += 1
+
+        print(f"\n{'='*60}")
+        print(f"  Done: {passed} passed, {failed} failed, {skipped} skipped")
+        print(f"{'='*60}")
+    finally:
+        # Always clean up, even on KeyboardInterrupt, so a spawned server never outlives the run
+        if service is not None:
+            next(service_gen, None)  # delete the smoke service
+        client.close()  # close keep-alive sockets before the server shuts down
+        if proc:
+            stop_uvicorn(proc)
+            print("  server stopped")
 
 if __name__ == "__main__":
     main()
@@ -419,14 +419,8 @@ class TestRecoverVerifyResponse:
         await client.post(f"/api/v1/services/{svc.slug}/recover/generate")
 
         # Mock the HTTP fetch to return wrong content + bypass SSRF check
-        with patch("app.routes.api.httpx.AsyncClient") as MockClient, \
+        with patch("app.routes.api.fetch_verify_challenge", AsyncMock(return_value="wrong-challenge-value")), \
              patch("app.routes.api.is_public_hostname", return_value=True):
-            mock_resp = AsyncMock()
-            mock_resp.text = "wrong-challenge-value"
-            mock_instance = AsyncMock()
-            mock_instance.get.return_value = mock_resp
-            MockClient.return_value.__aenter__ = AsyncMock(return_value=mock_instance)
-            MockClient.return_value.__aexit__ = AsyncMock(return_value=False)
 
             resp = await client.post(f"/api/v1/services/{svc.slug}/recover/verify")
             assert resp.status_code == 403
@@ -440,14 +434,8 @@ class TestRecoverVerifyResponse:
         challenge = gen_resp.json()["challenge"]
 
         # Mock the HTTP fetch to return the correct challenge + bypass SSRF check
-        with patch("app.routes.api.httpx.AsyncClient") as MockClient, \
+        with patch("app.routes.api.fetch_verify_challenge", AsyncMock(return_value=challenge)), \
              patch("app.routes.api.is_public_hostname", return_value=True):
-            mock_resp = AsyncMock()
-            mock_resp.text = challenge
-            mock_instance = AsyncMock()
-            mock_instance.get.return_value = mock_resp
-            MockClient.return_value.__aenter__ = AsyncMock(return_value=mock_instance)
-            MockClient.return_value.__aexit__ = AsyncMock(return_value=False)
 
             resp = await client.post(f"/api/v1/services/{svc.slug}/recover/verify")
             assert resp.status_code == 200
@@ -480,12 +468,8 @@ class TestRecoverVerifyResponse:
         await client.post(f"/api/v1/services/{svc.slug}/recover/generate")
 
         # Bypass SSRF check but let httpx raise
-        with patch("app.routes.api.httpx.AsyncClient") as MockClient, \
+        with patch("app.routes.api.fetch_verify_challenge", AsyncMock(side_effect=Exception("Connection refused"))), \
              patch("app.routes.api.is_public_hostname", return_value=True):
-            mock_instance = AsyncMock()
-            mock_instance.get.side_effect = Exception("Connection refused")
-            MockClient.return_value.__aenter__ = AsyncMock(return_value=mock_instance)
-            MockClient.return_value.__aexit__ = AsyncMock(return_value=False)
 
             resp = await client.post(f"/api/v1/services/{svc.slug}/recover/verify")
             assert resp.status_code == 502
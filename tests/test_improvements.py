@@ -103,6 +103,51 @@ class TestWebPagination:
         # Pagination links should include the category filter
         assert "category=tools" in resp.text
 
+    @pytest.mark.asyncio
+    async def test_directory_pagination_encodes_query(self, client: AsyncClient, many_services):
+        resp = await client.get("/directory?q=number&category=tools&sort=cheapest")
+        # Filters carry over into the page links, URL-encoded
+        assert "q=number&amp;category=tools&amp;sort=cheapest&amp;page=2" in resp.text
+
+        resp = await client.get("/directory", params={"q": " Service number "})
+        assert "q=Service+number&amp;page=2" in resp.text
+
+    @pytest.mark.asyncio
+    async def test_directory_next_link_uses_keyset_cursor(self, client: AsyncClient, many_services):
+        import re
+
+        for sort in ("cheapest", "newest", "top-rated"):
+            resp = await client.get(f"/directory?sort={sort}")
+            next_href = re.search(r'href="(/directory\?[^"]*page=2&amp;after=[^"]+)"', resp.text).group(1)
+
+            by_cursor = await client.get(next_href.replace("&amp;", "&"))
+            by_offset = await client.get(f"/directory?sort={sort}&page=2")
+            assert by_cursor.status_code == 200
+            names = lambda html: re.findall(r"Service \d\d", html)
+            assert names(by_cursor.text) == names(by_offset.text)
+            assert len(set(names(by_cursor.text))) == 5
+
+    @pytest.mark.asyncio
+    async def test_directory_malformed_cursor_falls_back_to_offset(self, client: AsyncClient, many_services):
+        resp = await client.get("/directory?page=2&after=not-a-cursor")
+        assert resp.status_code == 200
+        assert ">2</span>/" in resp.text
+
+    @pytest.mark.asyncio
+    async def test_directory_page_count_follows_new_services(self, client: AsyncClient, db: AsyncSession, many_services):
+        resp = await client.get("/directory?category=tools")
+        assert ">1</span>/<a" in resp.text and ">2</a></span>" in resp.text
+
+        cats = (await db.execute(select(Category).where(Category.slug == "tools"))).scalars().all()
+        for i in range(25, 45):
+            svc = Service(name=f"Service {i:02d}", slug=f"service-{i:02d}", url=f"https://svc-{i:02d}.example.com")
+            svc.categories = list(cats)
+            db.add(svc)
+        await db.commit()
+
+        resp = await client.get("/directory?category=tools")
+        assert ">3</a></span>" in resp.text
+
     @pytest.mark.asyncio
     async def test_search_returns_paginated(self, client: AsyncClient, many_services):
         resp = await client.get("/search?q=Service")
@@ -255,6 +300,17 @@ class TestSitemap:
         assert "/directory" in resp.text
 
 
+    @pytest.mark.asyncio
+    async def test_sitemap_revalidates_with_etag(self, client: AsyncClient):
+        resp = await client.get("/sitemap.xml")
+        assert resp.headers["cache-control"] == "public, max-age=3600"
+        etag = resp.headers["etag"]
+
+        resp = await client.get("/sitemap.xml", headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.content == b""
+
+
 class TestRobotsTxt:
     @pytest.mark.asyncio
     async def test_robots_returns_text(self, client: AsyncClient):
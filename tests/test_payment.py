@@ -4,7 +4,7 @@ import hashlib
 
 import pytest
 import pytest_asyncio
-from httpx import ASGITransport, AsyncClient
+from httpx import AsyncClient
 from unittest.mock import patch, AsyncMock
 
 from app.config import settings
@@ -12,7 +12,7 @@ from app.l402 import mint_macaroon
 from app.main import app, limiter
 from app.database import get_db
 
-from tests.conftest import _make_db, _teardown_db
+from tests.conftest import _make_db, _teardown_db, _transport
 
 
 MOCK_INVOICE = {
@@ -24,18 +24,17 @@ MOCK_INVOICE = {
 @pytest_asyncio.fixture
 async def payment_client():
     """Client fixture for payment tests with test-mode enabled."""
-    engine, session = await _make_db()
+    conn, session = await _make_db()
 
     async def override_get_db():
         yield session
 
     app.dependency_overrides[get_db] = override_get_db
     limiter.reset()
-    transport = ASGITransport(app=app)
-    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+    async with AsyncClient(transport=_transport, base_url="http://test") as ac:
         yield ac
     app.dependency_overrides.clear()
-    await _teardown_db(engine, session)
+    await _teardown_db(conn, session)
 
 
 def _make_l402_token(preimage_bytes: bytes) -> tuple[str, str]:
@@ -10,7 +10,7 @@ from app.config import (
     MAX_OWNER_CONTACT, MAX_LOGO_URL, MAX_REVIEWER_NAME, MAX_COMMENT,
 )
 from app.models import Service
-from app.utils import is_public_hostname, escape_like
+from app.utils import is_public_hostname, escape_like, extract_domain
 
 
 # ---------------------------------------------------------------------------
@@ -166,6 +166,21 @@ class TestSSRFProtection:
     def test_zero_ip_blocked(self):
         assert is_public_hostname("0.0.0.0") is False
 
+    @pytest.mark.parametrize("url", [
+        "https://API.Example.com:8443/v1?x=1#f",
+        "http://user:pw@example.com/a@b",
+        "http://evil.com\\@127.0.0.1/",
+        "http://[::1]:8080/",
+        "http://ex%41mple.com/",
+        " http://example.com",
+        "//example.com/path",
+        "example.com",
+    ])
+    def test_extract_domain_matches_urlparse(self, url):
+        """The SSRF check and the fetch must agree on which host a URL names."""
+        from urllib.parse import urlparse
+        assert extract_domain(url) == (urlparse(url).hostname or "")
+
 
 # ---------------------------------------------------------------------------
 # 4. CSRF: Origin header check
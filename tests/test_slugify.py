@@ -1,8 +1,10 @@
 """Tests for slugify to prevent regressions in slug generation."""
 
 import pytest
+from sqlalchemy import select
 
-from app.utils import slugify
+from app.models import Category, Service, service_categories
+from app.utils import flush_with_unique_slug, slugify, unique_slug
 
 
 @pytest.mark.parametrize("input_text,expected", [
@@ -25,6 +27,37 @@ from app.utils import slugify
     ("service (beta) #1", "service-beta-1"),
     # No leading/trailing hyphens
     (".leading/trailing.", "leading-trailing"),
+    # Non-ASCII: unicode letters kept, unicode spaces dashed, symbols dropped
+    ("Café Übersicht", "café-übersicht"),
+    ("naïve\u00a0api 🚀", "naïve-api"),
 ])
 def test_slugify(input_text, expected):
     assert slugify(input_text) == expected
+
+
+@pytest.mark.asyncio
+async def test_unique_slug_picks_lowest_free_suffix(db):
+    for slug in ("my-api", "my-api-1", "my-api-3", "my-api-beta"):
+        db.add(Service(name=slug, slug=slug, url=f"https://{slug}.example.com"))
+    await db.commit()
+
+    assert await unique_slug(db, "My API") == "my-api-2"
+    assert await unique_slug(db, "My API 1") == "my-api-1-1"
+    assert await unique_slug(db, "Other API") == "other-api"
+
+
+@pytest.mark.asyncio
+async def test_flush_with_unique_slug_retries_on_collision(db):
+    db.add(Service(name="My API", slug="my-api", url="https://taken.example.com"))
+    await db.commit()
+    cats = (await db.execute(select(Category).where(Category.slug == "tools"))).scalars().all()
+
+    svc = Service(name="My API", url="https://new.example.com")
+    await flush_with_unique_slug(db, svc, "My API", cats)
+    await db.commit()
+
+    assert svc.slug == "my-api-1"
+    linked = (await db.execute(
+        select(service_categories.c.category_id).where(service_categories.c.service_id == svc.id)
+    )).scalars().all()
+    assert linked == [cats[0].id]
@@ -1,8 +1,11 @@
+from unittest.mock import AsyncMock, patch
+
 import pytest
 from httpx import AsyncClient
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.config import settings
 from app.models import Service, Rating
 from app.routes.web import _meta_token
 
@@ -120,6 +123,26 @@ class TestDirectory:
         assert "Test API" not in resp.text
         assert "Dual Protocol API" in resp.text
 
+    @pytest.mark.asyncio
+    async def test_etag_revalidation(self, client: AsyncClient, sample_service: Service):
+        resp = await client.get("/directory?sort=newest")
+        etag = resp.headers["etag"]
+        assert resp.status_code == 200
+
+        resp = await client.get("/directory?sort=newest", headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.content == b""
+
+        # Different filters get a different ETag
+        resp = await client.get("/directory?sort=popular", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+
+        # A new rating changes the listing, so the old ETag no longer matches
+        await client.post(f"/services/{sample_service.slug}/rate", data={"score": "5"})
+        resp = await client.get("/directory?sort=newest", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.headers["etag"] != etag
+
 
 class TestSearch:
     @pytest.mark.asyncio
@@ -152,6 +175,21 @@ class TestSearch:
         assert resp.status_code == 200
         assert "Test API" in resp.text
 
+    def test_search_filter_matches_fts_index_on_postgres(self):
+        """The @@ operand must compile exactly like the GIN index expression,
+        or Postgres can't use the index."""
+        from sqlalchemy.dialects import postgresql
+        from sqlalchemy.schema import CreateIndex
+        from app.utils import search_filter
+
+        index = next(i for i in Service.__table__.indexes if i.name == "ix_services_search_fts")
+        index_sql = str(CreateIndex(index).compile(dialect=postgresql.dialect()))
+        filter_sql = str(search_filter("pay", "postgresql").compile(dialect=postgresql.dialect()))
+        document = index_sql[index_sql.index("(to_tsvector") + 1:-1]
+        assert document.replace("name", "services.name").replace("description", "services.description") in filter_sql
+        assert "@@ websearch_to_tsquery('english'" in filter_sql
+        assert "@@" not in str(search_filter("pay", "sqlite").compile())
+
 
 class TestServiceDetail:
     @pytest.mark.asyncio
@@ -237,6 +275,15 @@ class TestOwnerDashboard:
         assert resp.status_code == 200
         assert "Owner Dashboard" in resp.text or "api.test.com" in resp.text
 
+    @pytest.mark.asyncio
+    async def test_owner_traffic_domain_is_case_insensitive(self, client: AsyncClient, db: AsyncSession):
+        """Service.domain is stored lowercased, so mixed-case hosts match via the index."""
+        db.add(Service(name="Mixed Case", slug="mixed-case", url="https://API.MixedCase.com/v1"))
+        await db.commit()
+        resp = await client.get("/api/v1/owner/Api.mixedcase.COM/traffic")
+        assert resp.status_code == 200
+        assert resp.json()["service_count"] == 1
+
     @pytest.mark.asyncio
     async def test_owner_dashboard_404_unknown_domain(self, client: AsyncClient):
         resp = await client.get("/owner/nonexistent.example.com")
@@ -315,6 +362,14 @@ class TestSubmitService:
         svc = result.scalars().first()
         assert svc is not None
 
+    @pytest.mark.asyncio
+    async def test_submit_ignores_malformed_category_ids(self, client: AsyncClient, db: AsyncSession):
+        resp = await client.post("/submit", content="name=Bad+Cats&url=https%3A%2F%2Fbadcats.example.com&categories=abc&categories=1", headers={"Content-Type": "application/x-www-form-urlencoded"}, follow_redirects=False)
+        assert resp.status_code == 200
+
+        result = await db.execute(select(Service).where(Service.slug == "bad-cats"))
+        assert result.scalars().first() is not None
+
     @pytest.mark.asyncio
     async def test_submit_dual_protocol(self, client: AsyncClient, db: AsyncSession):
         resp = await client.post("/submit", content="name=Dual+Submit&url=https%3A%2F%2Fdual-submit.example.com&protocol=L402%2Bx402&pricing_sats=100&pricing_model=per-request&x402_pay_to=0xWallet&x402_network=eip155%3A8453&pricing_usd=0.05&categories=9", headers={"Content-Type": "application/x-www-form-urlencoded"}, follow_redirects=False)
@@ -359,6 +414,17 @@ class TestRateService:
         assert sample_service.rating_count == 2
         assert sample_service.avg_rating == 3.0
 
+    @pytest.mark.asyncio
+    async def test_rate_avg_does_not_drift_from_rounding(self, client: AsyncClient, sample_service: Service, db: AsyncSession):
+        for score in ("1", "1", "2", "1"):
+            await client.post("/services/test-api/rate", data={"score": score, "comment": ""})
+
+        await db.refresh(sample_service)
+        # 1.3 after three ratings; the fourth must give the exact 5/4, not (1.3*3+1)/4
+        assert sample_service.rating_count == 4
+        assert sample_service.rating_sum == 5
+        assert sample_service.avg_rating == 1.3
+
     @pytest.mark.asyncio
     async def test_rate_clamps_score(self, client: AsyncClient, sample_service: Service, db: AsyncSession):
         resp = await client.post("/services/test-api/rate", data={"score": "10"})
@@ -379,3 +445,30 @@ class TestRateService:
         result = await db.execute(select(Rating).where(Rating.service_id == sample_service.id))
         rating = result.scalars().first()
         assert rating.reviewer_name == "Anonymous"
+
+    @pytest.mark.asyncio
+    async def test_rate_resubmit_same_payment_is_idempotent(self, client: AsyncClient, sample_service: Service, db: AsyncSession):
+        service_id = sample_service.id  # the replayed consume rolls back and expires it
+        with patch.object(settings, "AUTH_ROOT_KEY", "replay-test-key"), \
+             patch("app.routes.web.check_payment_status", new_callable=AsyncMock) as mock_status:
+            mock_status.return_value = (True, settings.AUTH_REVIEW_PRICE_SATS)
+            for _ in range(2):
+                resp = await client.post(
+                    "/services/test-api/rate?payment_hash=" + "ab" * 32,
+                    data={"score": "4", "comment": "Paid once"},
+                )
+                assert resp.status_code == 200
+                assert "Paid once" in resp.text
+
+        result = await db.execute(select(Rating).where(Rating.service_id == service_id))
+        assert len(result.scalars().all()) == 1
+
+
+class TestPaymentStatus:
+    @pytest.mark.asyncio
+    async def test_payment_status_not_cacheable(self, client: AsyncClient):
+        resp = await client.get("/payment-status/abc123")
+        assert resp.status_code == 200
+        assert resp.json() == {"paid": True}
+        assert resp.headers["content-type"] == "application/json"
+        assert resp.headers["cache-control"] == "no-store"